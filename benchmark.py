@@ -0,0 +1,204 @@
+"""
+==============================================================================
+benchmark
+------------------------------------------------------------------------------
+Timing and peak-memory benchmarks for lts_processor and xsec_analysis.
+
+Each scale is a total number of survey points, split into stations of
+--points points. A synthetic job file (see synthetic_job) is written for
+each scale, then every benchmark is timed (best of --repeat runs) and run
+once more under tracemalloc to record peak Python memory. Setup such as
+parsing the job before processing it is not included in the timings.
+
+--imports instead checks the import time of each module against
+IMPORT_BUDGETS, measured with python -X importtime in fresh interpreters,
+and exits with status 1 if a module is over budget or imports one of
+LAZY_MODULES eagerly.
+
+Usage:
+    python benchmark.py --scales 1000 10000 100000 1000000 --output bench_output.txt
+    python benchmark.py --imports
+==============================================================================
+"""
+import argparse
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import lts_processor as lp
+import xsec_analysis as xa
+from synthetic_job import write_job
+
+
+N_QUERIES = 1000
+
+
+def parsed(columnar = False):
+    return lambda ctx: lp.Job(ctx["fpath"], columnar = columnar)
+
+
+def processed(columnar = False):
+    def setup(ctx):
+        job = lp.Job(ctx["fpath"], columnar = columnar)
+        job.process_all()
+        return job
+    return setup
+
+
+def corrections_table(ctx):
+    job = lp.Job(ctx["fpath"], lazy = True)
+    stations = [s.station_id for s in job.iter_stations(keep = False)]
+    return (processed()(ctx), pd.DataFrame({"station": stations, "easting": 1000.0, 
+                                            "northing": 2000.0, "elevation": 100.0}))
+
+
+def long_profile(ctx):
+    rng = np.random.default_rng(0)
+    x = np.sort(rng.uniform(0, 1000, ctx["n_points"]))
+    x[0], x[-1] = 0, 1000
+    y = np.abs(x - 500) / 50 + rng.normal(0, 0.05, len(x))
+    return x, y, rng.uniform(0, 400, N_QUERIES), rng.uniform(600, 1000, N_QUERIES)
+
+
+def export_dir(job):
+    # Inside the temporary directory the job file was written to
+    return os.path.join(os.path.dirname(os.path.abspath(job.fpath)), "exports")
+
+
+def geometry_queries(state):
+    x, y, left, right = state
+    geometry = xa.ChannelGeometry(x, y)
+    for xl, xr in zip(left, right):
+        geometry.hydraulics(xl, xr)
+        geometry.polygon_area(xl, geometry.bed(xl), xr, geometry.bed(xr))
+
+
+def lookup_queries(state):
+    x, y, left, right = state
+    lookup = xa.SortedLookup(x, y)
+    for v in left:
+        lookup.interpolate(v)
+        lookup.nearest(v)
+
+
+# (name, setup(ctx) -> state, run(state)); run is the part that is measured
+BENCHMARKS = [
+    ("parse", lambda ctx: ctx, parsed()),
+    ("parse_columnar", lambda ctx: ctx, parsed(columnar = True)),
+    ("process_station", parsed(), lambda job: [job.data_dict[t].process() for t in job.station_list]),
+    ("process_all", parsed(), lambda job: job.process_all()),
+    ("process_all_columnar", parsed(columnar = True), lambda job: job.process_all()),
+    ("correct_all", corrections_table, lambda state: state[0].correct_all(state[1])),
+    ("export_csv", processed(), lambda job: job.export_all(output_dir = export_dir(job))),
+    ("export_npz", processed(), lambda job: job.export_all(output_dir = export_dir(job), format = "npz")),
+    ("rating_curves", processed(columnar = True), lambda job: job.rating_curves(0.035, 0.001, 50)),
+    ("detect_banks", processed(columnar = True), lambda job: xa.job_banks(job)),
+    ("geometry_queries", long_profile, geometry_queries),
+    ("lookup_queries", long_profile, lookup_queries),
+]
+
+
+# Cumulative import time allowed per module in seconds (best of several runs)
+IMPORT_BUDGETS = {"lts_processor": 0.3, "xsec_analysis": 0.3, "xsec_main": 0.4}
+# Modules that must only be imported when they are first used
+LAZY_MODULES = ("pandas", "matplotlib", "concurrent.futures.process")
+
+
+def import_time(module, runs = 5):
+    """Returns (best import time in seconds, LAZY_MODULES loaded) for module.
+
+    Each run imports the module in a fresh interpreter with -X importtime
+    and reads its cumulative time from the report.
+    """
+    best = float("inf")
+    code = f"import sys, {module}; print(' '.join(sys.modules))"
+    for i in range(runs):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], 
+                                cwd = os.path.dirname(os.path.abspath(__file__)),
+                                capture_output = True, text = True, check = True)
+        for line in result.stderr.splitlines():
+            fields = line.split("|")
+            # Top-level imports are the only ones not indented in the report
+            if len(fields) == 3 and fields[2].rstrip() == " " + module:
+                best = min(best, int(fields[1]) / 1e6)
+    loaded = result.stdout.split()
+    return best, [name for name in LAZY_MODULES if name in loaded]
+
+
+def check_imports(runs = 5):
+    """Prints import times against IMPORT_BUDGETS; returns False on any failure"""
+    ok = True
+    for module, budget in IMPORT_BUDGETS.items():
+        try:
+            seconds, eager = import_time(module, runs)
+        except subprocess.CalledProcessError as error:
+            print("{:<22} skipped ({})".format(module, error.stderr.strip().splitlines()[-1]))
+            continue
+        passed = seconds <= budget and not eager
+        ok = ok and passed
+        print("{:<22} {:>8.4f} s (budget {:.2f} s) {}{}".format(module, seconds, budget, 
+                                                               "ok" if passed else "FAILED",
+                                                               "; imports " + ", ".join(eager) if eager else ""))
+    return ok
+
+
+def measure(setup, run, ctx, repeat):
+    """Returns (best wall time in seconds, peak traced memory in bytes)"""
+    best = float("inf")
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(repeat):
+            state = setup(ctx)
+            start = time.perf_counter()
+            run(state)
+            best = min(best, time.perf_counter() - start)
+        state = setup(ctx)
+        tracemalloc.start()
+        run(state)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return best, peak
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Benchmark lts_processor and xsec_analysis")
+    parser.add_argument("--scales", type = int, nargs = "+", default = [10**3, 10**4, 10**5],
+                        help = "total number of survey points per run")
+    parser.add_argument("--points", type = int, default = 100, help = "points per station")
+    parser.add_argument("--repeat", type = int, default = 3, help = "timed runs per benchmark")
+    parser.add_argument("--only", nargs = "+", help = "names of the benchmarks to run")
+    parser.add_argument("--output", help = "also write the results table to this file")
+    parser.add_argument("--imports", action = "store_true", 
+                        help = "check import times against IMPORT_BUDGETS instead")
+    args = parser.parse_args(argv)
+    if args.imports:
+        sys.exit(0 if check_imports() else 1)
+    rows = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for scale in args.scales:
+            n_stations = max(scale // args.points, 1)
+            ctx = {"fpath": write_job(os.path.join(tmpdir, f"job_{scale}.txt"), n_stations, args.points),
+                   "n_points": n_stations * args.points}
+            for name, setup, run in BENCHMARKS:
+                if args.only and name not in args.only:
+                    continue
+                seconds, peak = measure(setup, run, ctx, args.repeat)
+                rows.append({"benchmark": name, 
+                             "points": ctx["n_points"], 
+                             "seconds": round(seconds, 6),
+                             "points_per_second": round(ctx["n_points"] / seconds) if seconds > 0 else float("inf"),
+                             "peak_mb": round(peak / 2**20, 3)})
+                print("{:<22} {:>9} points {:>10.4f} s {:>10.2f} MB".format(name, ctx["n_points"], 
+                                                                          seconds, peak / 2**20))
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(pd.DataFrame(rows).to_string(index = False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 """
 ==============================================================================
-lts_processor v0.2.0
+lts_processor v0.12.0
 Carl Helander carl.helander@mq.edu.au
 ------------------------------------------------------------------------------
 Changelog:
@@ -9,6 +9,46 @@ Changelog:
            - Minor improvements to the .export() method for Station class
     v0.2.0 - Added functionality to correct coordinates to a particular
              location
+    v0.3.0 - Replaced the row-by-row loop in Station.process with a vectorised
+             NumPy transect distance engine (transect_distances) and added a
+             job-level batched mode to Job.process_all
+    v0.3.1 - Replaced the whole-file read in Job.__init__ with a streaming,
+             line-oriented parser (parse_job); stations can now be built
+             lazily with Job(fpath, lazy=True) and Job.iter_stations()
+    v0.4.0 - Added an optional columnar backend (JobStore, enabled with
+             Job(fpath, columnar=True)) that keeps every point of a job in
+             one structured array; Station.df is then built on demand
+    v0.4.1 - Job.process_all and Job.export_all accept workers=N to spread
+             stations over a process (or thread) pool; removed all os.chdir
+             calls, output paths are now passed explicitly
+    v0.5.0 - Added export_all(format="npz") to write a whole job to a single
+             columnar archive and Job.load() to memory-map it back
+    v0.5.1 - Added non-interactive batch correction from a corrections table
+             (Station.correct_to(manual=False), Job.correct_all(corrections))
+    v0.6.0 - Added vectorised stage-discharge (rating curve) computation for
+             one or many transects (rating_curves, Job.rating_curves)
+    v0.7.0 - Every stage now records its wall time, point count and bytes in
+             Job.metrics (summarised by Job.stats(), forwarded to callbacks
+             such as log_metrics()); Job(fpath, quiet=True) drops the
+             per-station progress lines
+    v0.7.1 - pandas and matplotlib are now imported on first use (LazyModule),
+             so columnar parse/process/npz runs work without pandas loaded
+    v0.8.0 - Added JobCache, a size-bounded on-disk cache of parsed (and
+             optionally processed) jobs; Job(fpath, cache=JobCache()) maps
+             unchanged files from the cache instead of parsing them
+    v0.9.0 - Added Job.refresh() to read only the stations appended to a job
+             file since it was last read (scan_job resumes from a byte offset)
+    v0.10.0 - Implemented Job.plot_all: every profile is rendered off screen
+              to PNG/SVG files (optionally from a process pool) or to one
+              multi-page PDF, reusing a single figure (render_profiles)
+    v0.11.0 - Added uniform-chainage resampling (resample_transects,
+              Station.resample, Job.resample) that keeps breakpoints such as
+              bank positions; a resampled job can go straight to export_all
+    v0.11.1 - Split interpolate_transects out of resample_transects and added
+              Job.arrays() for whole-job column access (used by xsec_change)
+    v0.12.0 - Added SpatialIndex, a grid index over the points of many jobs
+              for nearest, radius and bounding-box queries; jobs are added
+              incrementally and export_all(index=...) saves it alongside
     
 ------------------------------------------------------------------------------
 Help on lts_processor (lp) module:
@@ -34,30 +74,988 @@ Quick start:
 ==============================================================================
 """
 import os
-import pandas as pd
+import hashlib
+import importlib
+import json
+import logging
+import time
 import datetime as dt
-import matplotlib.pyplot as plt
+import numpy as np
 import math
+import struct
+import zipfile
+
+
+class LazyModule:
+    """Stands in for a module that is only imported on first attribute access.
+
+    Keeps heavy optional dependencies (pandas, matplotlib) out of the import
+    time of this module; an ImportError is raised on first use if the module
+    is not installed.
+    """
+    def __init__(self, name):
+        self._name = name
+
+
+    def __getattr__(self, attr):
+        value = getattr(importlib.import_module(self._name), attr)
+        # Later lookups of the same attribute skip __getattr__
+        setattr(self, attr, value)
+        return value
+
+
+pd = LazyModule("pandas")
+plt = LazyModule("matplotlib.pyplot")
+
+COLNAMES = ["pt_id", "easting", "northing", "elevation", "trg_height"]
+POINT_DTYPE = np.dtype([("pt_id", "U16"),
+                        ("easting", "f8"),
+                        ("northing", "f8"),
+                        ("elevation", "f8"),
+                        ("trg_height", "f8")])
 
 
 def euc_dist(x1 = None, x2 = None, y1 = None, y2 = None):
     return math.sqrt((x2-x1) ** 2 + (y2-y1) ** 2)
 
 
+def to_floats(values):
+    """Converts parsed fields to floats, with NaN for any that are not numbers"""
+    values = np.asarray(values)
+    try:
+        return values.astype(float)
+    except ValueError:
+        floats = np.full(len(values), np.nan)
+        for i, value in enumerate(values):
+            try:
+                floats[i] = float(value)
+            except ValueError:
+                pass
+        return floats
+
+
+def numeric_column(column):
+    """Converts a column of parsed fields to numbers.
+
+    Point IDs may be text and are kept as they are; other fields that are
+    not numbers become NaN.
+    """
+    try:
+        return pd.to_numeric(column)
+    except ValueError:
+        if column.name == "pt_id":
+            return column
+        return pd.Series(to_floats(column), index = column.index, name = column.name)
+
+
+def transect_distances(easting, northing, offsets = None):
+    """Computes x_dist, cum_distance and mirrored arrays in one batched pass.
+
+    easting and northing are 1-D arrays of point coordinates. If offsets is
+    given, the arrays hold several transects back to back and offsets holds
+    the start index of each transect plus the total length (len(offsets) is
+    n_transects + 1); distances never run across a transect boundary.
+    Returns (x_dist, cum_distance, mirrored, horizontaldistance), where
+    horizontaldistance holds one value per transect. Values agree with the
+    old row-by-row loop to rounding, not bit for bit: squares are taken as
+    dx * dx, and cum_distance comes from one sum over the whole job.
+    """
+    easting = np.asarray(easting, dtype = float)
+    northing = np.asarray(northing, dtype = float)
+    if offsets is None:
+        offsets = np.array([0, len(easting)])
+    offsets = np.asarray(offsets, dtype = np.int64)
+    x_dist = np.zeros(len(easting))
+    if len(easting) > 1:
+        dx = easting[:-1] - easting[1:]
+        dy = northing[1:] - northing[:-1]
+        x_dist[1:] = np.sqrt(dx ** 2 + dy ** 2)
+    # The first point of every transect starts at zero
+    x_dist[offsets[:-1][offsets[:-1] < len(x_dist)]] = 0
+    # One running sum over the whole job, restarted at the first point of
+    # every transect; a NaN step makes the rest of its own transect NaN
+    starts, lengths = offsets[:-1], np.diff(offsets)
+    gaps = np.isnan(x_dist)
+    total = np.concatenate([[0], np.cumsum(np.where(gaps, 0, x_dist))])
+    cum_distance = total[1:] - np.repeat(total[starts], lengths)
+    n_gaps = np.concatenate([[0], np.cumsum(gaps)])
+    cum_distance[n_gaps[1:] > np.repeat(n_gaps[starts], lengths)] = np.nan
+    horizontaldistance = np.zeros(len(offsets) - 1)
+    if len(cum_distance):
+        horizontaldistance[lengths > 0] = np.fmax.reduceat(cum_distance, starts[lengths > 0])
+    mirrored = np.repeat(horizontaldistance, np.diff(offsets)) - cum_distance
+    return x_dist, cum_distance, mirrored, horizontaldistance
+
+
+def rating_curves(x, y, stages, offsets = None, max_block = 1000000):
+    """Flow geometry over a grid of stages for one or more transects at once.
+
+    x (chainage) and y (elevation) are 1-D arrays; with offsets they hold
+    several transects back to back, as for transect_distances. stages has
+    one row of water levels per transect (a 1-D array is used for a single
+    transect). Every bed segment below a stage is wetted, and water above
+    the ends of a transect is held by vertical walls that do not count as
+    wetted perimeter. Returns a dict of (n_transects, n_stages) arrays:
+    area, wetted_perimeter, hydraulic_radius and top_width. Transects are
+    evaluated in blocks of about max_block segment-stage pairs to bound
+    memory, and the stages in blocks too when a single transect is longer.
+    """
+    x = np.asarray(x, dtype = float)
+    y = np.asarray(y, dtype = float)
+    stages = np.atleast_2d(np.asarray(stages, dtype = float))
+    if offsets is None:
+        offsets = [0, len(x)]
+    offsets = np.asarray(offsets, dtype = np.int64)
+    n_transects, n_stages = len(offsets) - 1, stages.shape[1]
+    result = {name: np.zeros((n_transects, n_stages)) for name in ("area", "wetted_perimeter", "top_width")}
+    n_segments = np.maximum(np.diff(offsets) - 1, 0)
+    stage_block = max(max_block // max(int(n_segments.max(initial = 0)), 1), 1)
+    if stage_block < n_stages:
+        parts = [rating_curves(x, y, stages[:, i:i + stage_block], offsets, max_block) 
+                 for i in range(0, n_stages, stage_block)]
+        return {name: np.concatenate([part[name] for part in parts], axis = 1) for name in parts[0]}
+    blocks = np.cumsum(n_segments) * n_stages // max_block
+    for block in np.unique(blocks):
+        transects = np.flatnonzero((blocks == block) & (n_segments > 0))
+        if len(transects) == 0:
+            continue
+        # Left-hand point of every segment in the block and the transect it belongs to
+        seg_counts = n_segments[transects]
+        seg_transect = np.repeat(transects, seg_counts)
+        first_seg = np.concatenate([[0], np.cumsum(seg_counts)[:-1]])
+        left = offsets[seg_transect] + np.arange(len(seg_transect)) - np.repeat(first_seg, seg_counts)
+        dx = (x[left + 1] - x[left])[:, None]
+        dy = (y[left + 1] - y[left])[:, None]
+        d1 = stages[seg_transect] - y[left][:, None]
+        d2 = stages[seg_transect] - y[left + 1][:, None]
+        wet = (d1 >= 0) & (d2 >= 0)
+        partial = ~wet & ((d1 > 0) | (d2 > 0))
+        deepest = np.maximum(d1, d2)
+        fraction = wet.astype(float)
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            fraction[partial] = (deepest / np.abs(d1 - d2))[partial]
+        area = np.where(wet, dx * (d1 + d2) / 2, fraction * dx * deepest / 2)
+        result["area"][transects] = np.add.reduceat(area, first_seg, axis = 0)
+        result["wetted_perimeter"][transects] = np.add.reduceat(fraction * np.hypot(dx, dy), first_seg, axis = 0)
+        result["top_width"][transects] = np.add.reduceat(fraction * dx, first_seg, axis = 0)
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        result["hydraulic_radius"] = np.where(result["wetted_perimeter"] > 0, 
+                                              result["area"] / result["wetted_perimeter"], 0.0)
+    return result
+
+
+def manning_velocity(hydraulic_radius, slope, mannings):
+    """Mean flow velocity from Manning's equation (SI units)"""
+    return np.power(hydraulic_radius, 2 / 3) * np.sqrt(slope) / mannings
+
+
+def chainage_grid(starts, ends, spacing = None, n_points = None):
+    """Uniform chainages from start to end of every transect.
+
+    Grids either step by spacing (stopping at or before the end) or have
+    n_points (at least 2) evenly spaced points, ending exactly at the end.
+    Transects with a NaN start or end get no points. Returns (chainage,
+    offsets) with the grids back to back.
+    """
+    starts = np.asarray(starts, dtype = float)
+    ends = np.asarray(ends, dtype = float)
+    valid = np.isfinite(starts) & np.isfinite(ends)
+    counts = np.zeros(len(starts), dtype = np.int64)
+    if n_points is not None:
+        if n_points < 2:
+            raise ValueError("n_points must be at least 2 to cover both ends")
+        counts[valid] = n_points
+        step = (ends - starts) / (n_points - 1)
+    elif spacing is not None:
+        # The small tolerance stops e.g. 10 / 0.1 = 99.99... losing the last step
+        counts[valid] = np.floor((ends - starts)[valid] / spacing + 1e-9).astype(np.int64) + 1
+        step = np.full(len(starts), float(spacing))
+    else:
+        raise ValueError("Either spacing or n_points is needed")
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    transect = np.repeat(np.arange(len(starts)), counts)
+    k = np.arange(offsets[-1]) - offsets[:-1][transect]
+    chainage = np.minimum(starts[transect] + k * step[transect], ends[transect])
+    # Rounding can leave the last point a hair short of the end, which
+    # resample_transects would then keep as a separate point
+    last = offsets[1:][counts > 0] - 1
+    at_end = n_points is not None or np.abs(ends[counts > 0] - chainage[last]) <= 1e-9 * spacing
+    chainage[last] = np.where(at_end, ends[counts > 0], chainage[last])
+    return chainage, offsets
+
+
+def resample_transects(x, columns, offsets = None, spacing = None, n_points = None, breakpoints = None):
+    """Interpolates transects onto uniform chainage grids, all in one pass.
+
+    x is the chainage (cum_distance) of every point, non-decreasing within
+    each transect, and columns is a dict of arrays to interpolate linearly
+    (e.g. elevation), with offsets as for transect_distances. Grids are
+    built by chainage_grid. The first and last point of each transect and
+    any breakpoints, a pair of (transect index, chainage) arrays such as
+    bank positions, are always kept. Returns (chainage, values, offsets,
+    fixed): the resampled chainages and dict of columns back to back, their
+    offsets, and a mask of the kept end points and breakpoints.
+    """
+    x = np.asarray(x, dtype = float)
+    if offsets is None:
+        offsets = [0, len(x)]
+    offsets = np.asarray(offsets, dtype = np.int64)
+    n = len(offsets) - 1
+    lengths = np.diff(offsets)
+    has_points = np.flatnonzero(lengths > 0)
+    starts = np.full(n, np.nan)
+    ends = np.full(n, np.nan)
+    starts[has_points] = x[offsets[has_points]]
+    ends[has_points] = x[offsets[has_points + 1] - 1]
+    grid, grid_offsets = chainage_grid(starts, ends, spacing, n_points)
+    if breakpoints is None:
+        breakpoints = (np.zeros(0, dtype = np.int64), np.zeros(0))
+    b_transect = np.asarray(breakpoints[0], dtype = np.int64)
+    b_x = np.asarray(breakpoints[1], dtype = float)
+    inside = (b_x >= starts[b_transect]) & (b_x <= ends[b_transect])
+    q_transect = np.concatenate([b_transect[inside], has_points, has_points, 
+                                 np.repeat(np.arange(n), np.diff(grid_offsets))])
+    q_x = np.concatenate([b_x[inside], starts[has_points], ends[has_points], grid])
+    fixed = np.arange(len(q_x)) < len(q_x) - len(grid)
+    # Sort by (transect, chainage), fixed points first as lexsort is stable, then drop repeats
+    order = np.lexsort((q_x, q_transect))
+    q_transect, q_x, fixed = q_transect[order], q_x[order], fixed[order]
+    first = np.ones(len(q_x), dtype = bool)
+    first[1:] = (q_transect[1:] != q_transect[:-1]) | (q_x[1:] != q_x[:-1])
+    q_transect, q_x, fixed = q_transect[first], q_x[first], fixed[first]
+    new_offsets = np.concatenate([[0], np.cumsum(np.bincount(q_transect, minlength = n))])
+    if n_points is not None:
+        # Without breakpoints every transect of non-zero length has exactly n_points
+        plain = ends > starts
+        plain[b_transect[inside]] = False
+        if (np.diff(new_offsets)[plain] != n_points).any():
+            raise ValueError("Resampling did not give {} points on every transect".format(n_points))
+    return q_x, interpolate_transects(x, columns, offsets, q_x, new_offsets), new_offsets, fixed
+
+
+def interpolate_transects(x, columns, offsets, q_x, q_offsets):
+    """Linearly interpolates columns of many transects at query chainages.
+
+    x, columns and offsets are as for resample_transects; q_x holds the
+    query chainages of every transect back to back, sorted within each
+    transect, with q_offsets. Queries beyond either end of a transect take
+    the value at that end. Returns a dict of arrays aligned with q_x.
+    """
+    x = np.asarray(x, dtype = float)
+    q_x = np.asarray(q_x, dtype = float)
+    offsets = np.asarray(offsets, dtype = np.int64)
+    n = len(offsets) - 1
+    q_transect = np.repeat(np.arange(n), np.diff(q_offsets))
+    # Merge the queries into the points (points first on ties, as lexsort
+    # is stable): the points before each query give the index of the first
+    # point past it
+    is_point = np.arange(len(x) + len(q_x)) < len(x)
+    merged = np.lexsort((np.concatenate([x, q_x]), 
+                         np.concatenate([np.repeat(np.arange(n), np.diff(offsets)), q_transect])))
+    right = np.cumsum(is_point[merged])[~is_point[merged]]
+    lo = offsets[:-1][q_transect]
+    hi = offsets[1:][q_transect] - 1
+    r = np.clip(right, lo, hi)
+    l = np.clip(right - 1, lo, hi)
+    dx = x[r] - x[l]
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        fraction = np.where(dx > 0, (q_x - x[l]) / dx, 0.0)
+    values = {}
+    for name, column in columns.items():
+        column = np.asarray(column, dtype = float)
+        values[name] = column[l] + fraction * (column[r] - column[l])
+    return values
+
+
+def parse_job(fpath):
+    """Reads a TCR-705 job file line by line and yields (header, rows) per station.
+
+    Blocks are separated by runs of blank lines. A block of four or more
+    lines is a station's survey data and the block before it is its header.
+    header is a list of comma-split header lines and rows is a list of
+    comma-split data lines truncated to the first five fields. Only the
+    current and previous block are held in memory.
+    """
+    for header, rows, resume in scan_job(fpath):
+        yield header, rows
+
+
+def scan_job(fpath, offset = 0, previous = None):
+    """As parse_job, but yields (header, rows, resume) and can start mid-file.
+
+    resume is (offset, block): the byte offset just past the blank line that
+    ends the station's block, and the block itself, so scan_job(fpath,
+    *resume) carries on with the next station. It is None for a final
+    station that no blank line follows yet, as its block may still grow.
+    A last line without a newline may still be being written and is left
+    out, so the next scan reads it whole.
+    """
+    previous = previous or []
+    block = []
+    with open(fpath, 'rb') as file:
+        file.seek(offset)
+        for line in file:
+            if not line.endswith(b'\n'):
+                break
+            line = line.replace(b' ', b'').strip()
+            if line:
+                block.append(line.decode())
+                continue
+            if len(block) > 3:
+                yield ([l.split(',') for l in previous], 
+                       [l.split(',')[0:5] for l in block],
+                       (file.tell(), block))
+            if block:
+                previous = block
+            block = []
+    if len(block) > 3:
+        yield ([l.split(',') for l in previous], 
+               [l.split(',')[0:5] for l in block],
+               None)
+
+
+def read_corrections(corrections):
+    """Returns a corrections table indexed by station ID.
+
+    corrections is a path to a CSV file or a DataFrame with a "station"
+    column (or index) and "easting", "northing" and "elevation" columns that
+    hold the corrected coordinates of the first point of each station.
+    Station IDs must be strings, as numbers would lose leading zeros.
+    """
+    if isinstance(corrections, pd.DataFrame):
+        corrections_df = corrections.copy()
+    else:
+        corrections_df = pd.read_csv(corrections, dtype = {"station": str})
+    if "station" in corrections_df.columns:
+        corrections_df = corrections_df.set_index("station")
+    missing = [c for c in ("easting", "northing", "elevation") if c not in corrections_df.columns]
+    if missing:
+        raise ValueError("Corrections table is missing column(s): {}".format(", ".join(missing)))
+    numeric = [t for t in corrections_df.index if not isinstance(t, str)]
+    if numeric:
+        raise ValueError("Corrections table has non-string station ID(s) such as {!r}; read it with "
+                         "dtype = {{'station': str}} to keep IDs like '00001'".format(numeric[0]))
+    return corrections_df[["easting", "northing", "elevation"]].astype(float)
+
+
+def make_pool(workers, threads = False):
+    """Returns a process pool, or a thread pool if threads is True"""
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+    if threads is True:
+        return ThreadPoolExecutor(max_workers = workers)
+    return ProcessPoolExecutor(max_workers = workers)
+
+
+def pooled_transect_distances(easting, northing, offsets, workers, threads = False):
+    """Runs transect_distances over contiguous chunks of transects in a pool.
+
+    Arguments and return values are the same as for transect_distances with
+    offsets given; the chunk results are stitched back together in order.
+    """
+    offsets = np.asarray(offsets, dtype = np.int64)
+    chunks = [c for c in np.array_split(np.arange(len(offsets) - 1), workers) if len(c) > 0]
+    args = [(easting[offsets[c[0]]:offsets[c[-1]+1]],
+             northing[offsets[c[0]]:offsets[c[-1]+1]],
+             offsets[c[0]:c[-1]+2] - offsets[c[0]]) for c in chunks]
+    with make_pool(workers, threads) as pool:
+        results = list(pool.map(transect_distances, *zip(*args)))
+    if len(results) == 0:
+        return transect_distances(easting, northing, offsets)
+    return tuple(np.concatenate(r) for r in zip(*results))
+
+
+def export_frame(df, fpath):
+    """Writes a station DataFrame to fpath (module level so it can be pooled)"""
+    df.to_csv(fpath)
+    return fpath
+
+
+def render_profiles(profiles, fpath = None, dpi = 100):
+    """Draws transect profiles off screen, reusing one figure for all of them.
+
+    profiles is a list of (title, x, y, out) tuples and each profile is
+    saved to its out path, in the format given by its extension. If fpath
+    is given, the profiles are written as the pages of one PDF at fpath
+    instead. Module level so it can be pooled. Returns the bytes written.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.backends.backend_pdf import PdfPages
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    axs = fig.add_subplot()
+    line, = axs.plot([], [])
+    markers, = axs.plot([], [], 'k+')
+    axs.set_xlabel('Transect distance (m)')
+    axs.set_ylabel('Elevation (m)')
+    pdf = PdfPages(fpath) if fpath is not None else None
+    try:
+        for title, x, y, out in profiles:
+            line.set_data(x, y)
+            markers.set_data(x, y)
+            axs.relim()
+            axs.autoscale_view()
+            axs.set_title(title)
+            if pdf is not None:
+                pdf.savefig(fig, dpi = dpi)
+            else:
+                fig.savefig(out, dpi = dpi)
+    finally:
+        if pdf is not None:
+            pdf.close()
+    if fpath is not None:
+        return os.path.getsize(fpath)
+    return sum(os.path.getsize(out) for title, x, y, out in profiles)
+
+
+def memmap_npz(fpath):
+    """Memory-maps every array stored in an uncompressed .npz archive.
+
+    np.savez stores each array uncompressed, so the raw .npy data sits
+    contiguously in the zip file and can be mapped in place. Returns a dict
+    of read-only arrays keyed by name.
+    """
+    arrays = {}
+    with zipfile.ZipFile(fpath) as zf, open(fpath, 'rb') as file:
+        for info in zf.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"'{info.filename}' in '{fpath}' is compressed and cannot be memory-mapped")
+            # Skip the zip local file header to reach the .npy data
+            file.seek(info.header_offset)
+            name_len, extra_len = struct.unpack('<HH', file.read(30)[26:30])
+            file.seek(info.header_offset + 30 + name_len + extra_len)
+            version = np.lib.format.read_magic(file)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+            name = info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+            if int(np.prod(shape)) == 0:
+                arrays[name] = np.empty(shape, dtype = dtype)
+            else:
+                arrays[name] = np.memmap(fpath, dtype = dtype, mode = 'r', offset = file.tell(), 
+                                         shape = shape, order = 'F' if fortran_order else 'C')
+    return arrays
+
+
+def log_metrics(logger = None, level = logging.INFO):
+    """Returns a Metrics callback that writes each record to a logger"""
+    logger = logger or logging.getLogger("lts_processor")
+    def callback(record):
+        logger.log(level, "%s %s: %.6f s, %d points, %d bytes",
+                   record["stage"], record["station"] or "(job)",
+                   record["seconds"], record["points"], record["bytes"])
+    return callback
+
+
+class Metrics:
+    """Wall time, point count and bytes for each stage of a job.
+
+    A record has a stage (parse, construct, load, process, correct, export,
+    plot, resample, cache or index), a station ID (None for whole-job
+    records), seconds, points and bytes (read from disk for parse and load, written for export, held by
+    the results otherwise). Records are kept as tuples in .records; each
+    callback is called with a record dict as it is made (see log_metrics).
+    """
+    FIELDS = ("stage", "station", "seconds", "points", "bytes")
+
+    def __init__(self, callbacks = None):
+        self.records = []
+        self.callbacks = list(callbacks or [])
+
+
+    def add(self, stage, seconds, station = None, points = 0, nbytes = 0):
+        record = (stage, station, seconds, int(points), int(nbytes))
+        self.records.append(record)
+        for callback in self.callbacks:
+            callback(dict(zip(self.FIELDS, record)))
+
+
+    def frame(self):
+        """Returns every record as a DataFrame, in the order they were made"""
+        return pd.DataFrame(self.records, columns = self.FIELDS)
+
+
+    def summary(self):
+        """Totals per stage, with whole-job and per-station records kept apart"""
+        df = self.frame()
+        df["scope"] = np.where(df["station"].isna(), "job", "station")
+        return df.groupby(["stage", "scope"], sort = False).agg(count = ("seconds", "size"),
+                                                               seconds = ("seconds", "sum"),
+                                                               mean_seconds = ("seconds", "mean"),
+                                                               points = ("points", "sum"),
+                                                               bytes = ("bytes", "sum"))
+
+
+def file_hash(fpath, chunk_size = 2**20):
+    """Returns the BLAKE2b hex digest of a file's contents"""
+    digest = hashlib.blake2b()
+    with open(fpath, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class JobCache:
+    """Size-bounded on-disk cache of parsed jobs, used with Job(fpath, cache=...).
+
+    Each job file is stored as an npz archive (see Job.export_archive) that
+    is memory-mapped back on a hit. Entries are keyed by absolute path and
+    checked against the file's size and mtime; if only the mtime has changed
+    the content hash decides. Stale entries are dropped and rebuilt, and the
+    least recently used entries are evicted once the archives add up to more
+    than max_bytes. With process=True jobs are processed before they are
+    cached.
+    """
+    def __init__(self, cache_dir = None, max_bytes = 2**30, process = False):
+        self.cache_dir = cache_dir or os.path.join(os.path.expanduser("~"), ".cache", "lts_processor")
+        self.max_bytes = max_bytes
+        self.process = process
+        os.makedirs(self.cache_dir, exist_ok = True)
+        self.index_path = os.path.join(self.cache_dir, "index.json")
+
+
+    def read_index(self):
+        try:
+            with open(self.index_path) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+
+    def write_index(self, index):
+        # Written to a temporary file first so readers never see half an index
+        tmp = "{}.{}.tmp".format(self.index_path, os.getpid())
+        with open(tmp, "w") as file:
+            json.dump(index, file, indent = 1)
+        os.replace(tmp, self.index_path)
+
+
+    def lookup(self, fpath, processed = False):
+        """Returns the archive cached for fpath, or None if missing or stale.
+
+        With processed=True entries cached before processing count as missing.
+        """
+        abspath = os.path.abspath(fpath)
+        index = self.read_index()
+        entry = index.get(abspath)
+        if entry is None:
+            return None
+        archive = os.path.join(self.cache_dir, entry["archive"])
+        stat = os.stat(abspath)
+        fresh = os.path.exists(archive) and entry["size"] == stat.st_size
+        if fresh and entry["mtime_ns"] != stat.st_mtime_ns:
+            fresh = entry["hash"] == file_hash(abspath)
+            entry["mtime_ns"] = stat.st_mtime_ns
+        if fresh is False:
+            self.remove(index, abspath)
+            self.write_index(index)
+            return None
+        if processed is True and entry["processed"] is False:
+            return None
+        entry["last_used"] = time.time()
+        self.write_index(index)
+        return archive
+
+
+    def restore(self, job):
+        """Loads job from the cache; returns False if there is no usable entry"""
+        start = time.perf_counter()
+        archive = self.lookup(job._abspath, processed = self.process)
+        if archive is None:
+            return False
+        job._attach_archive(memmap_npz(archive))
+        job.metrics.add("load", time.perf_counter() - start, None, len(job.store.points), 
+                        os.path.getsize(archive))
+        print("Loaded '{}' from cache ({} stations)".format(job.fname, len(job._station_list)))
+        return True
+
+
+    def store(self, job):
+        """Writes job to the cache, evicting old entries if it is over max_bytes"""
+        start = time.perf_counter()
+        stat = os.stat(job._abspath)
+        name = hashlib.sha1(job._abspath.encode()).hexdigest()
+        archive = os.path.join(self.cache_dir, name + ".npz")
+        tmp = os.path.join(self.cache_dir, "{}.{}.tmp.npz".format(name, os.getpid()))
+        job.export_archive(tmp)
+        os.replace(tmp, archive)
+        index = self.read_index()
+        index[job._abspath] = {"archive": name + ".npz",
+                               "size": stat.st_size,
+                               "mtime_ns": stat.st_mtime_ns,
+                               "hash": file_hash(job._abspath),
+                               "processed": all(job._data_dict[t].processed for t in job._station_list),
+                               "bytes": os.path.getsize(archive),
+                               "last_used": time.time()}
+        total = sum(entry["bytes"] for entry in index.values())
+        for abspath in sorted(index, key = lambda p: index[p]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if abspath != job._abspath:
+                total -= index[abspath]["bytes"]
+                self.remove(index, abspath)
+        self.write_index(index)
+        job.metrics.add("cache", time.perf_counter() - start, None, job._n_points(), os.path.getsize(archive))
+        return archive
+
+
+    def remove(self, index, abspath):
+        """Drops abspath from index and deletes its archive"""
+        entry = index.pop(abspath)
+        try:
+            os.remove(os.path.join(self.cache_dir, entry["archive"]))
+        except OSError:
+            # Already gone, or still mapped by another process on Windows
+            pass
+
+
+    def clear(self):
+        index = self.read_index()
+        for abspath in list(index):
+            self.remove(index, abspath)
+        self.write_index(index)
+
+
+class SpatialIndex:
+    """Grid index over the survey points of one or more jobs.
+
+    Points are bucketed into square cells of cell_size (in coordinate
+    units) and kept sorted by cell, so a cell, or a run of cells in one
+    column of the grid, is a contiguous slice found by binary search.
+    nearest(), radius() and bbox() only look at the cells a query touches.
+    add_job() merges a job's points into the sorted arrays without
+    re-sorting the rest; adding a job again replaces its points. save()
+    and SpatialIndex.load() keep the index next to the exports (see
+    Job.export_all(index=...)).
+    """
+    FNAME = "spatial_index.npz"
+    # Cell rows are stored with this offset so that keys sort by column, then row
+    _ROW_OFFSET = 2**31
+
+    def __init__(self, cell_size = 10.0):
+        self.cell_size = float(cell_size)
+        self.jobs = []
+        self.station_job = np.zeros(0, dtype = np.int64)
+        self.station_ids = np.zeros(0, dtype = "U1")
+        self.keys = np.zeros(0, dtype = np.int64)
+        self.x = np.zeros(0)
+        self.y = np.zeros(0)
+        self.z = np.zeros(0)
+        self.station = np.zeros(0, dtype = np.int64)
+        self.pt_id = np.zeros(0, dtype = "U1")
+        self._bounds = None
+
+
+    def __len__(self):
+        return len(self.keys)
+
+
+    def _cells(self, x, y):
+        return (np.floor(np.asarray(x) / self.cell_size).astype(np.int64), 
+                np.floor(np.asarray(y) / self.cell_size).astype(np.int64))
+
+
+    def _key(self, column, row):
+        return column * 2**32 + (row + self._ROW_OFFSET)
+
+
+    def add_job(self, job, corrected = False):
+        """Adds (or replaces) the points of a Job; returns the number added.
+
+        With corrected=True the corrected_* coordinates are indexed instead
+        of the raw ones. Points without coordinates are skipped.
+        """
+        start = time.perf_counter()
+        prefix = "corrected_" if corrected else ""
+        names = [prefix + "easting", prefix + "northing", prefix + "elevation"]
+        offsets, columns = job.arrays(names)
+        if job.store is not None:
+            pt_id = job.store.points["pt_id"]
+        else:
+            pt_id = np.concatenate([job.data_dict[t].df["pt_id"].to_numpy(dtype = str) 
+                                    for t in job.station_list] or [np.zeros(0, dtype = "U1")])
+        if job._abspath in self.jobs:
+            self.remove_job(job._abspath)
+        code = len(self.jobs)
+        self.jobs.append(job._abspath)
+        first = len(self.station_ids)
+        self.station_ids = np.concatenate([self.station_ids, np.array(job.station_list, dtype = str)])
+        self.station_job = np.concatenate([self.station_job, np.full(job.n_stations, code, dtype = np.int64)])
+        x, y, z = (np.asarray(columns[n], dtype = float) for n in names)
+        station = np.repeat(np.arange(first, first + job.n_stations), np.diff(offsets))
+        keep = np.isfinite(x) & np.isfinite(y)
+        self._insert(x[keep], y[keep], z[keep], station[keep], np.asarray(pt_id)[keep])
+        job.metrics.add("index", time.perf_counter() - start, None, int(keep.sum()), int(keep.sum()) * 3 * 8)
+        return int(keep.sum())
+
+
+    def _insert(self, x, y, z, station, pt_id):
+        keys = self._key(*self._cells(x, y))
+        order = np.argsort(keys, kind = "stable")
+        # New points go after existing points of the same cell, keeping both sorted
+        positions = np.searchsorted(self.keys, keys[order], side = "right")
+        for name, values in (("keys", keys), ("x", x), ("y", y), ("z", z), ("station", station), ("pt_id", pt_id)):
+            current = getattr(self, name)
+            if name == "pt_id":
+                current = current.astype(np.result_type(current, values))
+            setattr(self, name, np.insert(current, positions, values[order]))
+        self._bounds = None
+
+
+    def remove_job(self, fpath):
+        """Drops every point of the job read from fpath"""
+        code = self.jobs.index(os.path.abspath(fpath))
+        keep_station = self.station_job != code
+        # New station codes once the job's stations are gone
+        remap = np.cumsum(keep_station) - 1
+        keep = keep_station[self.station]
+        for name in ("keys", "x", "y", "z", "pt_id"):
+            setattr(self, name, getattr(self, name)[keep])
+        self.station = remap[self.station[keep]]
+        self.station_ids = self.station_ids[keep_station]
+        self.station_job = self.station_job[keep_station]
+        self.station_job[self.station_job > code] -= 1
+        del self.jobs[code]
+        self._bounds = None
+
+
+    def _bbox_indices(self, xmin, ymin, xmax, ymax):
+        """Indices of the points inside the box, edges included"""
+        if len(self.keys) == 0 or xmin > xmax or ymin > ymax:
+            return np.zeros(0, dtype = np.int64)
+        (c0, c1), (r0, r1) = self._cells([xmin, xmax], [ymin, ymax])
+        c0 = max(c0, self.keys[0] // 2**32)
+        c1 = min(c1, self.keys[-1] // 2**32)
+        if c1 < c0:
+            return np.zeros(0, dtype = np.int64)
+        columns = np.arange(c0, c1 + 1)
+        lo = np.searchsorted(self.keys, self._key(columns, r0), side = "left")
+        hi = np.searchsorted(self.keys, self._key(columns, r1), side = "right")
+        counts = hi - lo
+        index = np.repeat(lo - np.concatenate([[0], np.cumsum(counts)[:-1]]), counts) + np.arange(counts.sum())
+        inside = ((self.x[index] >= xmin) & (self.x[index] <= xmax) 
+                  & (self.y[index] >= ymin) & (self.y[index] <= ymax))
+        return index[inside]
+
+
+    def _radius_indices(self, x, y, r):
+        index = self._bbox_indices(x - r, y - r, x + r, y + r)
+        distance = np.hypot(self.x[index] - x, self.y[index] - y)
+        within = distance <= r
+        index, distance = index[within], distance[within]
+        order = np.argsort(distance, kind = "stable")
+        return index[order], distance[order]
+
+
+    def frame(self, index, distance = None):
+        """DataFrame of the indexed points at the given positions"""
+        station = self.station[index]
+        df = pd.DataFrame({"job": np.array(self.jobs, dtype = object)[self.station_job[station]],
+                           "station": self.station_ids[station],
+                           "pt_id": self.pt_id[index],
+                           "easting": self.x[index],
+                           "northing": self.y[index],
+                           "elevation": self.z[index]})
+        if distance is not None:
+            df["distance"] = distance
+        return df
+
+
+    def bbox(self, xmin, ymin, xmax, ymax):
+        """Every point inside a bounding box, as a DataFrame"""
+        return self.frame(self._bbox_indices(xmin, ymin, xmax, ymax))
+
+
+    def radius(self, x, y, r):
+        """Every point within r of (x, y), nearest first, as a DataFrame"""
+        return self.frame(*self._radius_indices(x, y, r))
+
+
+    def nearest(self, x, y, k = 1, by_station = False):
+        """The k points nearest to (x, y), nearest first, as a DataFrame.
+
+        With by_station=True only the nearest point of each station counts,
+        so the result is the k nearest transects.
+        """
+        if len(self.keys) == 0:
+            return self.frame(np.zeros(0, dtype = np.int64), np.zeros(0))
+        if self._bounds is None:
+            self._bounds = (self.x.min(), self.y.min(), self.x.max(), self.y.max())
+        xmin, ymin, xmax, ymax = self._bounds
+        # Once r reaches the furthest corner of the indexed area every point is in range
+        reach = np.hypot(max(x - xmin, xmax - x), max(y - ymin, ymax - y))
+        r = self.cell_size
+        while True:
+            index, distance = self._radius_indices(x, y, r)
+            if by_station:
+                first = np.unique(self.station[index], return_index = True)[1]
+                first.sort()
+                index, distance = index[first], distance[first]
+            if len(index) >= k or r >= reach:
+                return self.frame(index[:k], distance[:k])
+            r *= 2
+
+
+    def save(self, fpath):
+        """Writes the index to an .npz file"""
+        np.savez(fpath,
+                 cell_size = np.array([self.cell_size]),
+                 jobs = np.array(self.jobs, dtype = str),
+                 station_job = self.station_job,
+                 station_ids = self.station_ids,
+                 keys = self.keys,
+                 x = self.x,
+                 y = self.y,
+                 z = self.z,
+                 station = self.station,
+                 pt_id = self.pt_id)
+        return fpath
+
+
+    @classmethod
+    def load(cls, fpath):
+        """Reads an index written by save(); more jobs can then be added"""
+        with np.load(fpath) as arrays:
+            index = cls(float(arrays["cell_size"][0]))
+            index.jobs = [str(p) for p in arrays["jobs"]]
+            for name in ("station_job", "station_ids", "keys", "x", "y", "z", "station", "pt_id"):
+                setattr(index, name, arrays[name])
+        return index
+
+
+class JobStore:
+    """Columnar storage for every point of a job.
+
+    points is one structured array (POINT_DTYPE) holding the points of all
+    stations back to back, offsets holds the start index of each station
+    plus the total point count (in station_ids order) and columns holds
+    processed whole-job arrays such as x_dist, aligned with points.
+    """
+    def __init__(self, points, offsets, station_ids):
+        self.points = points
+        self.offsets = np.asarray(offsets, dtype = np.int64)
+        self.station_ids = list(station_ids)
+        self.index = {t: i for i, t in enumerate(self.station_ids)}
+        self.columns = {}
+
+
+    @classmethod
+    def from_blocks(cls, blocks):
+        """Builds a store from (station_id, rows) pairs, rows as from parse_job.
+
+        Coordinate fields that are not numbers are read as NaN.
+        """
+        station_ids = []
+        lengths = []
+        flat = []
+        for station_id, rows in blocks:
+            station_ids.append(station_id)
+            lengths.append(len(rows))
+            flat.extend(tuple(row) + ('nan',) * (len(COLNAMES) - len(row)) for row in rows)
+        try:
+            points = np.array(flat, dtype = POINT_DTYPE) if flat else np.empty(0, dtype = POINT_DTYPE)
+        except ValueError:
+            fields = np.array(flat, dtype = str)
+            points = np.empty(len(flat), dtype = POINT_DTYPE)
+            points["pt_id"] = fields[:, 0]
+            for i, name in enumerate(COLNAMES[1:], 1):
+                points[name] = to_floats(fields[:, i])
+        store = cls(points, np.concatenate([[0], np.cumsum(lengths, dtype = np.int64)]), station_ids)
+        store._drop_repeats()
+        return store
+
+
+    def extend(self, other, keep = None):
+        """Appends the stations of another store in place.
+
+        Only the first keep stations of this store are kept (all by default).
+        Processed columns that other does not have are filled with NaN.
+        """
+        keep = len(self.station_ids) if keep is None else keep
+        cut = self.offsets[keep]
+        self.points = np.concatenate([self.points[:cut], other.points])
+        self.offsets = np.concatenate([self.offsets[:keep+1], other.offsets[1:] + cut])
+        self.station_ids = self.station_ids[:keep] + other.station_ids
+        self.index = {t: i for i, t in enumerate(self.station_ids)}
+        for name, values in self.columns.items():
+            self.columns[name] = np.concatenate([values[:cut], other.columns.get(name, 
+                                                                                np.full(len(other.points), np.nan))])
+        self._drop_repeats()
+
+
+    def _drop_repeats(self):
+        """Keeps only the last block of a station ID that appears more than once.
+
+        A repeated ID is a re-shot transect, which replaces the earlier block
+        and takes its place later in file order.
+        """
+        if len(self.index) == len(self.station_ids):
+            return
+        blocks = np.array(sorted(self.index.values()), dtype = np.int64)
+        starts = self.offsets[blocks]
+        lengths = self.offsets[blocks + 1] - starts
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        rows = np.arange(offsets[-1]) + np.repeat(starts - offsets[:-1], lengths)
+        self.points = self.points[rows]
+        self.offsets = offsets
+        self.station_ids = [self.station_ids[i] for i in blocks]
+        self.index = {t: i for i, t in enumerate(self.station_ids)}
+        for name, values in self.columns.items():
+            self.columns[name] = values[rows]
+
+
+    def bounds(self, station_id):
+        i = self.index[station_id]
+        return self.offsets[i], self.offsets[i+1]
+
+
+    def frame(self, station_id):
+        """Returns a DataFrame of one station's points and processed columns"""
+        start, stop = self.bounds(station_id)
+        df = pd.DataFrame({name: self.points[name][start:stop] for name in COLNAMES})
+        try:
+            df['pt_id'] = pd.to_numeric(df['pt_id'])
+        except ValueError:
+            pass
+        for name, values in self.columns.items():
+            df[name] = values[start:stop]
+        return df
+
+
 class Station:
-    def __init__(self, data = None, info = None, colnames = None):
+    def __init__(self, data = None, info = None, colnames = None, store = None, 
+                 metrics = None, quiet = False):
         self.data = data
         self.info = info
         self.colnames = colnames
+        self.store = store
+        self.metrics = metrics
+        self.quiet = quiet
         self.station_id = self.info[0][0]
         self.station_easting = self.info[0][1]
         self.station_northing = self.info[0][2]
         self.station_elevation = self.info[0][3]
         self.station_height = self.info[0][4]
-        self.df = pd.DataFrame(self.data, 
-                               columns = self.colnames)\
-            .apply(pd.to_numeric, errors = 'ignore')
+        self._df = None
+        if self.store is None:
+            self.df = pd.DataFrame(self.data, 
+                                   columns = self.colnames)\
+                .apply(numeric_column)
         self.processed = False
+
+
+    @property
+    def df(self):
+        # Stations backed by a JobStore only build their DataFrame when used
+        if self._df is None and self.store is not None:
+            self._df = self.store.frame(self.station_id)
+        return self._df
+
+
+    @df.setter
+    def df(self, value):
+        self._df = value
     
 
     def plot(self):
@@ -72,121 +1070,833 @@ class Station:
         else:
             self.process()
             self.plot()
-        print("Plotted station '{}'".format(self.station_id))
+        if self.quiet is False:
+            print("Plotted station '{}'".format(self.station_id))
         
     
     def process(self):
         if self.processed is False:
-            self.df['x_dist'] = 0
-            self.df['cum_distance'] = 0
-            for n in range(1, len(self.df)): # For each index value in the each row of the DataFrame except first
-                self.df.loc[n, "x_dist"] = euc_dist(x2 = self.df.loc[n-1, 
-                                                                     "easting"],
-                                                    x1 = self.df.loc[n, 
-                                                                     "easting"],
-                                                    y2 = self.df.loc[n, 
-                                                                     "northing"],
-                                                    y1 =  self.df.loc[n-1, 
-                                                                      "northing"])
-    
-                self.df.loc[n, "cum_distance"] = (self.df.loc[n, 
-                                                              "x_dist"] + self.df.loc[n-1, "cum_distance"])
-                self.horizontaldistance = self.df['cum_distance'].max()
-                self.mirror()
-            print("Processed station '{}'".format(self.station_id))
-            self.processed = True
+            start = time.perf_counter()
+            x_dist, cum_distance, mirrored, hd = transect_distances(self.df['easting'].to_numpy(dtype = float),
+                                                                    self.df['northing'].to_numpy(dtype = float))
+            self.set_distances(x_dist, cum_distance, mirrored, hd[0])
+            if self.metrics is not None:
+                self.metrics.add("process", time.perf_counter() - start, self.station_id, len(x_dist), 
+                                 x_dist.nbytes + cum_distance.nbytes + mirrored.nbytes)
+            if self.quiet is False:
+                print("Processed station '{}'".format(self.station_id))
+
+
+    def set_distances(self, x_dist, cum_distance, mirrored, horizontaldistance):
+        """Stores the output of transect_distances on the station.
+
+        If the station is backed by a JobStore and its DataFrame has not been
+        built yet, the columns are expected to be in store.columns already.
+        """
+        if self._df is not None:
+            self.df['x_dist'] = x_dist
+            self.df['cum_distance'] = cum_distance
+            self.df['mirrored'] = mirrored
+        self.horizontaldistance = horizontaldistance
+        self.processed = True
             
     
-    def correct_to(self, manual = True):  
+    def correct_to(self, manual = True, corrections = None):  
+        """Corrects coordinates so the first point matches a known location.
+
+        With manual=True the corrected coordinates are typed in; otherwise
+        they are looked up in corrections (see read_corrections). Returns
+        False if the station is not in the corrections table.
+        """
         if manual is True:
             ct_easting = float(input(f"Enter corrected easting (x) for first point of station '{self.station_id}': "))
             ct_northing = float(input(f"Enter corrected northing (y) for first point of station '{self.station_id}': "))
             ct_elevation = float(input(f"Enter corrected elevation (z) for first point of station '{self.station_id}': "))
-            x_offset =  ct_easting - self.df.iloc[0]["easting"]
-            y_offset = ct_northing - self.df.iloc[0]["northing"]
-            z_offset = ct_elevation - self.df.iloc[0]["elevation"]
+        else:
+            corrections_df = read_corrections(corrections)
+            if self.station_id not in corrections_df.index:
+                if self.quiet is False:
+                    print(f"No correction found for station '{self.station_id}'")
+                return False
+            ct_easting, ct_northing, ct_elevation = corrections_df.loc[self.station_id]
+        start = time.perf_counter()
+        x_offset =  ct_easting - self.df.iloc[0]["easting"]
+        y_offset = ct_northing - self.df.iloc[0]["northing"]
+        z_offset = ct_elevation - self.df.iloc[0]["elevation"]
+        if manual is True:
             print(f"x offset: {x_offset}\ny offset: {y_offset}\nz offset: {z_offset}")
+        self.set_corrections(x_offset, y_offset, z_offset)
+        if self.metrics is not None:
+            points = len(self.df)
+            self.metrics.add("correct", time.perf_counter() - start, self.station_id, points, points * 3 * 8)
+        return True
+
+
+    def set_corrections(self, x_offset, y_offset, z_offset):
+        """Adds corrected_* columns shifted by the given offsets.
+
+        As with set_distances, a JobStore-backed station whose DataFrame has
+        not been built yet relies on the columns being in store.columns.
+        """
+        if self._df is not None:
             self.df["corrected_easting"] = self.df['easting'] + x_offset
             self.df["corrected_northing"] = self.df['northing'] + y_offset
             self.df["corrected_elevation"] = self.df['elevation'] + z_offset
-        else:
-            pass
-            #corrections_df = pd.read_csv(fp_locs, index = "station")
-            #corrections_df.set_index("station")
-            #print(corrections_df.iloc(self.station_id))
-            
-        
+
+
+    def resample(self, spacing = None, n_points = None, breakpoints = None):
+        """Returns the profile resampled to uniform chainages as a DataFrame.
+
+        Easting, northing and elevation are interpolated along cum_distance
+        (see resample_transects); breakpoints are chainages to keep, such as
+        bank positions. The breakpoint column flags those and the two ends.
+        """
+        self.process()
+        breakpoints = np.asarray(breakpoints if breakpoints is not None else [], dtype = float)
+        names = [c for c in self.df.columns if c in ("easting", "northing", "elevation") or c.startswith("corrected_")]
+        chainage, values, offsets, fixed = resample_transects(self.df['cum_distance'].to_numpy(dtype = float),
+                                                              {c: self.df[c].to_numpy(dtype = float) for c in names},
+                                                              spacing = spacing, n_points = n_points,
+                                                              breakpoints = (np.zeros(len(breakpoints), dtype = int), 
+                                                                             breakpoints))
+        return pd.DataFrame({"cum_distance": chainage, **values, "breakpoint": fixed})
+
 
     def mirror(self):
         self.df['mirrored'] = 0 - self.df['cum_distance'] + self.horizontaldistance
 
         
-    def export(self):
-        self.df.to_csv("station_{}.csv".format(self.station_id))
-        print("Exported station '{}'".format(self.station_id))
+    def export_path(self, output_dir = None):
+        return os.path.join(output_dir or '', "station_{}.csv".format(self.station_id))
+
+
+    def export(self, output_dir = None):
+        start = time.perf_counter()
+        fpath = export_frame(self.df, self.export_path(output_dir))
+        if self.metrics is not None:
+            self.metrics.add("export", time.perf_counter() - start, self.station_id, len(self.df), 
+                             os.path.getsize(fpath))
+        if self.quiet is False:
+            print("Exported station '{}'".format(self.station_id))
 
 
 class Job:
-    """This class contains methods for in"""
-    def __init__(self, fpath):
+    """This class contains methods for in
+
+    Timings for each stage are recorded in job.metrics (see Metrics and
+    Job.stats); callbacks are passed on to it. With quiet=True the
+    per-station progress lines are not printed. With a JobCache, unchanged
+    files are memory-mapped from the cache instead of being parsed.
+    """
+    def __init__(self, fpath, lazy = False, columnar = False, quiet = False, callbacks = None, 
+                 cache = None):
         self.processed = False
-        self.data_dict = {}
+        self.columnar = columnar
+        self.quiet = quiet
+        self.cache = cache
+        self.metrics = Metrics(callbacks)
+        self.store = None
         self.fpath = fpath
         self.fname = self.fpath.split("/")[-1]
-        self.station_list = []
-        # Open the dataset
-        os.chdir(self.fpath.replace(self.fname, ''))   
-        with open(self.fname) as file:
-            self.data_str = ''.join(line for line in file)\
-                .replace("\n\n\n", "\n\n").split("\n\n")
-            
-        for count, chunk in enumerate(self.data_str): # Call data blocks in txt file chunks
-            if chunk.count('\n') > 2: # Get chunks that are just data
-                header = [line.split(',') for line in self.data_str[count-1].replace(' ', '').split('\n')]
-                data = [line.split(',')[0:5] for line in chunk.replace(' ', '').split('\n')]
-                self.data_dict[header[0][0]] = Station(data = data, info = header, colnames = ["pt_id",
-                                                                                              "easting",
-                                                                                              "northing",
-                                                                                              "elevation",
-                                                                                              "trg_height"])
-                self.station_list.append(header[0][0])
-        self.n_stations = len(self.data_dict)
-        print("Imported '{}' ({} stations)".format(self.fname, self.n_stations))
+        self._data_dict = {}
+        self._station_list = []
+        self._complete = False
+        # Station blocks read so far by an unfinished iter_stations()
+        self._blocks_read = 0
+        self._abspath = os.path.abspath(self.fpath)
+        # Where refresh() resumes scanning (see scan_job), and the station
+        # parsed from an unterminated final block, if any
+        self._resume = (0, None)
+        self._pending = None
+        self._size = None
+        self._tail = b''
+        if lazy is False:
+            self.load_all()
+
+
+    @property
+    def data_dict(self):
+        self.load_all()
+        return self._data_dict
+
+
+    @property
+    def station_list(self):
+        self.load_all()
+        return self._station_list
+
+
+    @property
+    def n_stations(self):
+        return len(self.data_dict)
+
+
+    def stats(self):
+        """Aggregate timings per stage (see Metrics.summary)"""
+        return self.metrics.summary()
+
+
+    def _n_points(self):
+        if self.store is not None:
+            return len(self.store.points)
+        return sum(len(self.data_dict[t].df) for t in self.station_list)
+
+
+    def load_all(self):
+        """Parses every remaining station in the file (no-op once complete)"""
+        if self._complete is False:
+            if self.cache is not None and self.cache.restore(self):
+                return
+            for station in self.iter_stations():
+                pass
+            if self.cache is not None:
+                if self.cache.process is True:
+                    self.process_all()
+                self.cache.store(self)
+
+
+    def iter_stations(self, keep = True):
+        """Yields Station objects in file order, parsing the file as it goes.
+
+        Stations already built are reused. With keep=False newly parsed
+        stations are not stored on the job, so a large file can be streamed
+        through with bounded memory. A station ID that appears again (a
+        re-shot transect) replaces the earlier station, which has already
+        been yielded, and moves to the later position.
+        """
+        if self._complete is True:
+            for t in self._station_list:
+                yield self._data_dict[t]
+            return
+        if self.columnar is True:
+            self.load_columnar()
+            yield from self.iter_stations()
+            return
+        totals = {"parse": 0.0, "construct": 0.0, "points": 0}
+        size = os.path.getsize(self._abspath)
+        start = time.perf_counter()
+        for block, (header, data, resume) in enumerate(scan_job(self._abspath)):
+            parsed = time.perf_counter()
+            station_id = header[0][0]
+            if block < self._blocks_read:
+                # Read by an earlier pass that was not run to the end
+                if keep is True:
+                    self._track(None, resume)
+                totals["parse"] += parsed - start
+                yield self._data_dict[station_id]
+                start = time.perf_counter()
+                continue
+            station = Station(data = data, info = header, colnames = COLNAMES, 
+                              metrics = self.metrics, quiet = self.quiet)
+            built = time.perf_counter()
+            self.metrics.add("parse", parsed - start, station_id, len(data))
+            self.metrics.add("construct", built - parsed, station_id, len(data))
+            totals["parse"] += parsed - start
+            totals["construct"] += built - parsed
+            totals["points"] += len(data)
+            if keep is True:
+                self._add_station(station)
+                self._blocks_read += 1
+                self._track(station_id, resume)
+            yield station
+            start = time.perf_counter()
+        totals["parse"] += time.perf_counter() - start
+        self.metrics.add("parse", totals["parse"], None, totals["points"], size)
+        self.metrics.add("construct", totals["construct"], None, totals["points"])
+        if keep is True:
+            self._complete = True
+            self._mark(size)
+            print("Imported '{}' ({} stations)".format(self.fname, len(self._data_dict)))
         
         
-    def process_all(self):
-        for count, t in enumerate(self.data_dict):
-            print("Processing station '{}' ({}/{})...".format(t,
-                                                              count+1, 
-                                                              self.n_stations))
-            self.data_dict[t].process()
+    @classmethod
+    def load(cls, fpath, quiet = False, callbacks = None):
+        """Opens a job archive written by export_all(format="npz").
+
+        The archive is memory-mapped, so only the pages belonging to the
+        stations that are actually used are read from disk.
+        """
+        start = time.perf_counter()
+        arrays = memmap_npz(fpath)
+        job = cls(str(arrays["fpath"][0]), lazy = True, columnar = True, quiet = quiet, callbacks = callbacks)
+        job._attach_archive(arrays)
+        job.metrics.add("load", time.perf_counter() - start, None, len(job.store.points), os.path.getsize(fpath))
+        print("Loaded '{}' ({} stations)".format(fpath, job.n_stations))
+        return job
+
+
+    def arrays(self, names):
+        """Returns (offsets, {name: array}) with columns of every station back to back.
+
+        The job is processed first if needed. Columns a station does not have
+        are filled with NaN.
+        """
+        if not all(self.data_dict[t].processed for t in self.station_list):
+            self.process_all()
+        if self.store is not None and all(n in COLNAMES or n in self.store.columns for n in names):
+            return self.store.offsets, {n: self.store.points[n] if n in COLNAMES else self.store.columns[n] 
+                                        for n in names}
+        frames = [self.data_dict[t].df for t in self.station_list]
+        offsets = np.concatenate([[0], np.cumsum([len(df) for df in frames], dtype = np.int64)])
+        return offsets, {n: np.concatenate([df[n].to_numpy(dtype = float) if n in df else np.full(len(df), np.nan)
+                                            for df in frames] or [np.zeros(0)]) for n in names}
+
+
+    def resample(self, spacing = None, n_points = None, breakpoints = None):
+        """Returns a new job with every station resampled to uniform chainages.
+
+        Easting, northing, elevation and any corrected_* columns of all
+        stations are interpolated at once with resample_transects, either
+        every spacing metres or to n_points points per station. breakpoints
+        maps station IDs to chainages that must be kept, such as bank
+        positions; the "breakpoint" column flags them and the ends of each
+        station. The new job is columnar and already processed, so it can be
+        written straight out with export_all.
+        """
+        start = time.perf_counter()
+        if not all(self.data_dict[t].processed for t in self.station_list):
+            self.process_all()
+        names = ["easting", "northing", "elevation"]
+        if self.store is not None and "cum_distance" in self.store.columns:
+            offsets = self.store.offsets
+            x = self.store.columns["cum_distance"]
+            names += [c for c in self.store.columns if c.startswith("corrected_")]
+            columns = {c: self.store.points[c] if c in COLNAMES else self.store.columns[c] for c in names}
+        else:
+            frames = [self.data_dict[t].df for t in self.station_list]
+            offsets = np.concatenate([[0], np.cumsum([len(df) for df in frames], dtype = np.int64)])
+            x = np.concatenate([df["cum_distance"].to_numpy(dtype = float) for df in frames])
+            names += [c for c in dict.fromkeys(c for df in frames for c in df.columns) if c.startswith("corrected_")]
+            columns = {c: np.concatenate([df[c].to_numpy(dtype = float) if c in df else np.full(len(df), np.nan)
+                                          for df in frames]) for c in names}
+        breakpoints = breakpoints or {}
+        b_transect = [i for i, t in enumerate(self.station_list) for b in breakpoints.get(t, ())]
+        b_x = [b for t in self.station_list for b in breakpoints.get(t, ())]
+        chainage, values, new_offsets, fixed = resample_transects(x, columns, offsets, spacing, n_points,
+                                                                  (b_transect, b_x))
+        counts = np.diff(new_offsets)
+        points = np.zeros(len(chainage), dtype = POINT_DTYPE)
+        points["pt_id"] = np.arange(len(chainage)) - np.repeat(new_offsets[:-1], counts) + 1
+        for c in ("easting", "northing", "elevation"):
+            points[c] = values.pop(c)
+        points["trg_height"] = np.nan
+        x_dist = np.zeros(len(chainage))
+        x_dist[1:] = np.diff(chainage)
+        x_dist[new_offsets[:-1][counts > 0]] = 0
+        horizontaldistance = np.full(len(counts), np.nan)
+        horizontaldistance[counts > 0] = chainage[new_offsets[1:][counts > 0] - 1]
+        job = Job(self.fpath, lazy = True, columnar = True, quiet = self.quiet, callbacks = self.metrics.callbacks)
+        job.store = JobStore(points, new_offsets, self.station_list)
+        job.store.columns.update({"x_dist": x_dist,
+                                  "cum_distance": chainage,
+                                  "mirrored": np.repeat(horizontaldistance, counts) - chainage,
+                                  **values,
+                                  "breakpoint": fixed.astype(float)})
+        job._add_store_stations(self.station_list, {t: self.data_dict[t].info for t in self.station_list})
+        for i, t in enumerate(self.station_list):
+            job._data_dict[t].processed = True
+            job._data_dict[t].horizontaldistance = horizontaldistance[i]
+        job._complete = True
+        # A resampled job does not follow its file, so refresh() only rescans it
+        job._resume = None
+        self.metrics.add("resample", time.perf_counter() - start, None, len(chainage), points.nbytes)
+        print("Resampled '{}' ({} stations, {} points)".format(self.fname, len(self.station_list), len(chainage)))
+        return job
+
+
+    def _attach_archive(self, arrays):
+        """Builds store-backed stations from the arrays of a job archive"""
+        columns = [name for name in arrays if name not in ("fpath", "points", "offsets", "station_ids", 
+                                                           "headers", "horizontaldistance", "resume")]
+        self.columnar = True
+        self.store = JobStore(arrays["points"], arrays["offsets"], [str(t) for t in arrays["station_ids"]])
+        self.store.columns.update({name: arrays[name] for name in columns})
+        for i, station_id in enumerate(self.store.station_ids):
+            header = [line.split(',') for line in str(arrays["headers"][i]).split('\n')]
+            station = Station(info = header, colnames = COLNAMES, store = self.store, 
+                              metrics = self.metrics, quiet = self.quiet)
+            if "cum_distance" in columns:
+                station.processed = True
+                station.horizontaldistance = float(arrays["horizontaldistance"][i])
+            self._data_dict[station_id] = station
+            self._station_list.append(station_id)
+        self._complete = True
+        if "resume" in arrays and len(arrays["resume"]) > 0:
+            resume = arrays["resume"]
+            block = str(resume["block"][0])
+            self._resume = (int(resume["offset"][0]), block.split('\n') if block else None)
+            self._pending = str(resume["pending"][0]) or None
+            self._size = int(resume["size"][0])
+            self._tail = bytes(resume["tail"][0])
+        else:
+            # Older archives do not say where their stations end in the job file
+            self._resume = None
+
+
+    def rating_curves(self, mannings, slope, n_stages = 100, stages = None):
+        """Stage-discharge table for every station in the job.
+
+        By default stages run in n_stages steps from the lowest point of each
+        processed transect up to bankfull, the lower of the highest points on
+        either side of it (the higher one if that leaves no channel). A 1-D
+        array of stages can be given instead and is used for every station.
+        Returns a long-format DataFrame with one row per station and stage.
+        """
+        if not all(self.data_dict[t].processed for t in self.station_list):
+            self.process_all()
+        if self.store is not None and "cum_distance" in self.store.columns:
+            offsets = self.store.offsets
+            x = self.store.columns["cum_distance"]
+            y = self.store.points["elevation"]
+        else:
+            frames = [self.data_dict[t].df for t in self.station_list]
+            offsets = np.concatenate([[0], np.cumsum([len(df) for df in frames], dtype = np.int64)])
+            x = np.concatenate([df["cum_distance"].to_numpy(dtype = float) for df in frames])
+            y = np.concatenate([df["elevation"].to_numpy(dtype = float) for df in frames])
+        lengths = np.diff(offsets)
+        has_points = lengths > 0
+        starts = offsets[:-1][has_points]
+        lowest = np.full(len(lengths), np.nan)
+        bankfull = np.full(len(lengths), np.nan)
+        if has_points.any():
+            # Thalweg of each transect: the first point of its group after sorting by (transect, y)
+            transect = np.repeat(np.arange(len(lengths)), lengths)
+            thalweg = np.lexsort((y, transect))[starts]
+            lowest[has_points] = y[thalweg]
+            # Maxima over [start, thalweg) and [thalweg, end) of every transect
+            side_max = np.maximum.reduceat(y, np.column_stack([starts, thalweg]).ravel()).reshape(-1, 2)
+            side_max[:, 0] = np.maximum(side_max[:, 0], lowest[has_points])
+            bankfull[has_points] = np.where(side_max.min(axis = 1) > lowest[has_points], 
+                                            side_max.min(axis = 1), side_max.max(axis = 1))
+        if stages is None:
+            stages = lowest[:, None] + (bankfull - lowest)[:, None] * np.linspace(0, 1, n_stages)[None, :]
+        else:
+            stages = np.tile(np.asarray(stages, dtype = float), (len(lengths), 1))
+            n_stages = stages.shape[1]
+        curves = rating_curves(x, y, stages, offsets)
+        velocity = manning_velocity(curves["hydraulic_radius"], slope, mannings)
+        return pd.DataFrame({"station": np.repeat(self.station_list, n_stages),
+                             "stage": stages.ravel(),
+                             "depth": (stages - lowest[:, None]).ravel(),
+                             "area": curves["area"].ravel(),
+                             "wetted_perimeter": curves["wetted_perimeter"].ravel(),
+                             "hydraulic_radius": curves["hydraulic_radius"].ravel(),
+                             "top_width": curves["top_width"].ravel(),
+                             "velocity": velocity.ravel(),
+                             "discharge": (curves["area"] * velocity).ravel()})
+
+
+    def export_archive(self, fpath):
+        """Writes every station and its processed columns to one .npz archive"""
+        stations = [self.data_dict[t] for t in self.station_list]
+        if self.store is not None and all(s._df is None for s in stations):
+            # Nothing has been materialised, so the shared buffer is current
+            points = self.store.points
+            offsets = self.store.offsets
+            columns = dict(self.store.columns)
+        else:
+            frames = [s.df for s in stations]
+            offsets = np.concatenate([[0], np.cumsum([len(df) for df in frames], dtype = np.int64)])
+            points = np.empty(offsets[-1], dtype = POINT_DTYPE)
+            columns = {}
+            for name in COLNAMES:
+                points[name] = np.concatenate([df[name].to_numpy() for df in frames]) if frames else []
+            for name in dict.fromkeys(c for df in frames for c in df.columns if c not in COLNAMES):
+                columns[name] = np.concatenate([df[name].to_numpy(dtype = float) if name in df
+                                                else np.full(len(df), np.nan) for df in frames])
+        horizontaldistance = np.array([getattr(s, "horizontaldistance", np.nan) for s in stations], 
+                                      dtype = float)
+        np.savez(fpath, 
+                 fpath = np.array([self._abspath]),
+                 points = points, 
+                 offsets = offsets,
+                 station_ids = np.array(self.station_list, dtype = str),
+                 headers = np.array(['\n'.join(','.join(line) for line in s.info) for s in stations], dtype = str),
+                 horizontaldistance = horizontaldistance,
+                 resume = self._resume_record(),
+                 **columns)
+        return fpath
+
+
+    def _resume_record(self):
+        """The refresh() state of the job as a one-row structured array"""
+        if self._resume is None:
+            return np.array([], dtype = [("offset", "i8")])
+        block = '\n'.join(self._resume[1] or [])
+        pending = self._pending or ""
+        return np.array([(self._resume[0], block, pending, self._size or 0, self._tail)],
+                        dtype = [("offset", "i8"), ("block", "U{}".format(max(len(block), 1))),
+                                 ("pending", "U{}".format(max(len(pending), 1))), ("size", "i8"), 
+                                 ("tail", "S64")])
+
+
+    def load_columnar(self):
+        """Parses the whole file into a JobStore and builds store-backed stations"""
+        start = time.perf_counter()
+        size = os.path.getsize(self._abspath)
+        self.store, headers = self._scan_store()
+        parsed = time.perf_counter()
+        self._add_store_stations(self.store.station_ids, headers)
+        self._complete = True
+        self._mark(size)
+        n_points = len(self.store.points)
+        self.metrics.add("parse", parsed - start, None, n_points, size)
+        self.metrics.add("construct", time.perf_counter() - parsed, None, n_points, self.store.points.nbytes)
+        print("Imported '{}' ({} stations, {} points)".format(self.fname, 
+                                                              len(self._data_dict), 
+                                                              len(self.store.points)))
+
+
+    def _scan_store(self, offset = 0, previous = None, skip = ()):
+        """Parses stations into a new JobStore, from a byte offset.
+
+        Stations in skip are passed over. A station repeated within the scan
+        keeps its last block (see JobStore._drop_repeats).
+        """
+        headers = {}
+        def blocks():
+            for header, data, resume in scan_job(self._abspath, offset, previous):
+                station_id = header[0][0]
+                if station_id in skip:
+                    self._track(None, resume)
+                    continue
+                if station_id in headers:
+                    print("Station '{}' appears again in '{}', keeping the later block".format(station_id, 
+                                                                                              self.fname))
+                headers[station_id] = header
+                self._track(station_id, resume)
+                yield station_id, data
+        return JobStore.from_blocks(blocks()), headers
+
+
+    def _add_store_stations(self, station_ids, headers):
+        for station_id in station_ids:
+            self._add_station(Station(info = headers[station_id], 
+                                      colnames = COLNAMES, 
+                                      store = self.store,
+                                      metrics = self.metrics,
+                                      quiet = self.quiet))
+
+
+    def _add_station(self, station):
+        """Adds a station after the others, replacing one with the same ID (a re-shot transect)"""
+        if station.station_id in self._data_dict:
+            print("Station '{}' appears again in '{}', keeping the later block".format(station.station_id, 
+                                                                                      self.fname))
+            self._station_list.remove(station.station_id)
+        self._data_dict[station.station_id] = station
+        self._station_list.append(station.station_id)
+
+
+    def _track(self, station_id, resume):
+        """Notes where refresh() should resume after a parsed station.
+
+        station_id is the station that was added, or None if it was skipped.
+        """
+        if resume is not None:
+            self._resume = resume
+        elif station_id is not None:
+            self._pending = station_id
+
+
+    def _mark(self, size):
+        """Remembers the file size and the bytes just before the resume point"""
+        self._size = size
+        if self._resume is not None:
+            with open(self._abspath, 'rb') as file:
+                file.seek(max(self._resume[0] - 64, 0))
+                self._tail = file.read(min(self._resume[0], 64))
+
+
+    def refresh(self, process = None):
+        """Parses stations appended to the job file since it was last read.
+
+        Scanning resumes after the last station block that was followed by a
+        blank line, so the cost depends on the new data only; a final station
+        without one may still have been growing and is parsed again. New
+        stations are processed if process=True, or by default if all earlier
+        stations were. If the file has shrunk or the bytes just before the
+        resume point have changed, it is taken to have been rewritten and
+        the job is read again from scratch. Returns the IDs of the stations
+        added, including re-shot stations that replaced an earlier block.
+        """
+        if self._complete is False:
+            self.load_all()
+            return list(self._station_list)
+        size = os.path.getsize(self._abspath)
+        if size == self._size:
+            return []
+        skip = ()
+        if self._resume is None:
+            # Loaded from an archive: the whole file is scanned, known stations are skipped
+            offset, previous = 0, None
+            skip = set(self._data_dict)
+        else:
+            offset, previous = self._resume
+            with open(self._abspath, 'rb') as file:
+                file.seek(max(offset - 64, 0))
+                rewritten = size < offset or file.read(min(offset, 64)) != self._tail
+            if rewritten:
+                print("'{}' has changed, re-importing".format(self.fname))
+                self.store = None
+                self._data_dict = {}
+                self._station_list = []
+                self._complete = False
+                self._blocks_read = 0
+                self._resume = (0, None)
+                self._pending = None
+                return self.refresh(process)
+        if process is None:
+            process = len(self._station_list) > 0 and all(self._data_dict[t].processed for t in self._station_list)
+        start = time.perf_counter()
+        keep = len(self._station_list)
+        if self._pending is not None:
+            # The pending station is always the last one read
+            del self._data_dict[self._station_list.pop()]
+            self._pending = None
+            keep -= 1
+        if self.store is not None:
+            new, headers = self._scan_store(offset, previous, skip)
+            self.store.extend(new, keep)
+            added = new.station_ids
+            self._add_store_stations(added, headers)
+            n_points = len(new.points)
+        else:
+            added = []
+            n_points = 0
+            for header, data, resume in scan_job(self._abspath, offset, previous):
+                station_id = header[0][0]
+                if station_id in skip:
+                    self._track(None, resume)
+                    continue
+                self._add_station(Station(data = data, info = header, colnames = COLNAMES, 
+                                          metrics = self.metrics, quiet = self.quiet))
+                self._track(station_id, resume)
+                if station_id in added:
+                    added.remove(station_id)
+                added.append(station_id)
+                n_points += len(data)
+        self._mark(size)
+        self.metrics.add("parse", time.perf_counter() - start, None, n_points, size - offset)
+        print("Refreshed '{}' ({} new stations)".format(self.fname, len(added)))
+        if process is True and added:
+            self.process_all()
+        return added
+
+
+    def process_all(self, batch = True, workers = None, threads = False):
+        """Processes every station in the job.
+
+        With batch=True all unprocessed stations are concatenated and run
+        through transect_distances in a single call; otherwise each station
+        is processed on its own. With workers > 1 the batch is split into
+        contiguous chunks of stations that are processed in a process pool
+        (a thread pool if threads=True); results are assigned back in
+        station_list order.
+        """
+        began = time.perf_counter()
+        if batch is False:
+            for count, t in enumerate(self.data_dict):
+                if self.quiet is False:
+                    print("Processing station '{}' ({}/{})...".format(t,
+                                                                      count+1, 
+                                                                      self.n_stations))
+                self.data_dict[t].process()
+            n_points = self._n_points()
+            self.metrics.add("process", time.perf_counter() - began, None, n_points, n_points * 3 * 8)
+            return
+        if self.store is not None:
+            # Work directly on the job's shared point buffer. If its columns
+            # can be updated in place, stations before the first unprocessed
+            # one (e.g. those kept by refresh) are left alone.
+            stations = [self.data_dict[t] for t in self.store.station_ids]
+            first = 0
+            if "cum_distance" in self.store.columns and self.store.columns["cum_distance"].flags.writeable:
+                first = next((i for i, s in enumerate(stations) if s.processed is False), len(stations))
+                if first == len(stations):
+                    return
+            base = self.store.offsets[first]
+            stations = stations[first:]
+            offsets = self.store.offsets[first:] - base
+            easting = self.store.points['easting'][base:]
+            northing = self.store.points['northing'][base:]
+        else:
+            stations = [self.data_dict[t] for t in self.station_list if self.data_dict[t].processed is False]
+            if len(stations) == 0:
+                return
+            lengths = [len(s.df) for s in stations]
+            offsets = np.concatenate([[0], np.cumsum(lengths)])
+            easting = np.concatenate([s.df['easting'].to_numpy(dtype = float) for s in stations])
+            northing = np.concatenate([s.df['northing'].to_numpy(dtype = float) for s in stations])
+        if workers is not None and workers > 1:
+            x_dist, cum_distance, mirrored, hd = pooled_transect_distances(easting, northing, offsets, 
+                                                                           workers, threads)
+        else:
+            x_dist, cum_distance, mirrored, hd = transect_distances(easting, northing, offsets)
+        if self.store is not None and first > 0:
+            self.store.columns["x_dist"][base:] = x_dist
+            self.store.columns["cum_distance"][base:] = cum_distance
+            self.store.columns["mirrored"][base:] = mirrored
+        elif self.store is not None:
+            self.store.columns.update({"x_dist": x_dist,
+                                       "cum_distance": cum_distance,
+                                       "mirrored": mirrored})
+        for i, s in enumerate(stations):
+            start, stop = offsets[i], offsets[i+1]
+            s.set_distances(x_dist[start:stop], cum_distance[start:stop], 
+                            mirrored[start:stop], hd[i])
+        self.metrics.add("process", time.perf_counter() - began, None, len(x_dist), 
+                         x_dist.nbytes + cum_distance.nbytes + mirrored.nbytes)
+        print("Processed '{}' ({} stations)".format(self.fname, len(stations)))
         
         
-    def plot_all(self, individual=True):
-        pass
-            
-    def correct_all(self):
-        for count, t in enumerate(self.data_dict):
-            print("Correcting station '{}' ({}/{})...".format(t,
-                                                            count+1, 
-                                                            self.n_stations))
-            self.data_dict[t].correct_to()                          
+    def plot_all(self, individual = True, output_dir = None, format = "png", workers = None, dpi = 100):
+        """Renders every station's profile to image files and returns the path.
+
+        With individual=True each station is drawn to station_<id>.<format>
+        (png, svg or pdf) in a timestamped directory, spread over a process
+        pool if workers > 1; otherwise all stations go to the pages of one
+        timestamped PDF. Figures are drawn off screen, so nothing is shown.
+        Output goes inside output_dir as for export_all.
+        """
+        start = time.perf_counter()
+        if not all(self.data_dict[t].processed for t in self.station_list):
+            self.process_all()
+        if self.store is not None and "cum_distance" in self.store.columns:
+            x = self.store.columns["cum_distance"]
+            y = self.store.points["elevation"]
+            bounds = [self.store.bounds(t) for t in self.station_list]
+            curves = [(x[a:b], y[a:b]) for a, b in bounds]
+        else:
+            curves = [(self.data_dict[t].df['cum_distance'].to_numpy(dtype = float), 
+                       self.data_dict[t].df['elevation'].to_numpy(dtype = float)) for t in self.station_list]
+        cdir = self._output_path(output_dir, extensions = (".npz", ".pdf"))
+        profiles = [("Transect {}".format(t), x, y, os.path.join(cdir, "station_{}.{}".format(t, format))) 
+                    for t, (x, y) in zip(self.station_list, curves)]
+        if individual is False:
+            nbytes = render_profiles(profiles, cdir + ".pdf", dpi)
+            cdir = cdir + ".pdf"
+        else:
+            os.mkdir(cdir)
+            if workers is not None and workers > 1:
+                chunks = [c for c in np.array_split(np.arange(len(profiles)), workers) if len(c) > 0]
+                with make_pool(workers) as pool:
+                    nbytes = sum(pool.map(render_profiles, [[profiles[i] for i in c] for c in chunks],
+                                          [None] * len(chunks), [dpi] * len(chunks)))
+            else:
+                nbytes = render_profiles(profiles, dpi = dpi)
+        self.metrics.add("plot", time.perf_counter() - start, None, sum(len(x) for x, y in curves), nbytes)
+        print("Plotted '{}' ({} stations) to '{}'".format(self.fname, len(profiles), cdir))
+        return cdir
+
+
+    def correct_all(self, corrections = None):
+        """Corrects every station's coordinates.
+
+        Without corrections each station is corrected interactively. With a
+        corrections table (CSV path or DataFrame, see read_corrections) the
+        table is joined to all stations at once and the offsets are applied
+        across the whole job in one pass. Stations missing from the table get
+        NaN corrected columns, and their IDs are returned.
+        """
+        if corrections is None:
+            for count, t in enumerate(self.data_dict):
+                if self.quiet is False:
+                    print("Correcting station '{}' ({}/{})...".format(t,
+                                                                    count+1, 
+                                                                    self.n_stations))
+                self.data_dict[t].correct_to()                          
+            return []
+        start = time.perf_counter()
+        cols = ["easting", "northing", "elevation"]
+        matched = read_corrections(corrections).reindex(self.station_list)
+        missing = list(matched.index[matched.isna().any(axis = 1)])
+        if self.store is not None:
+            first = self.store.points[self.store.offsets[:-1]]
+            first_xyz = np.column_stack([first[c] for c in cols])
+        else:
+            first_xyz = np.array([[self.data_dict[t].df[c].iat[0] for c in cols] for t in self.station_list], 
+                                 dtype = float).reshape(-1, 3)
+        xyz_offsets = matched[cols].to_numpy() - first_xyz
+        if self.store is not None:
+            per_point = np.repeat(xyz_offsets, np.diff(self.store.offsets), axis = 0)
+            for i, c in enumerate(cols):
+                self.store.columns["corrected_" + c] = self.store.points[c] + per_point[:, i]
+        for i, t in enumerate(self.station_list):
+            self.data_dict[t].set_corrections(*xyz_offsets[i])
+        n_points = self._n_points()
+        self.metrics.add("correct", time.perf_counter() - start, None, n_points, n_points * 3 * 8)
+        print("Corrected '{}' ({} stations)".format(self.fname, self.n_stations - len(missing)))
+        if missing:
+            print("No corrections found for station(s): {}".format(", ".join(missing)))
+        return missing
         
             
-    def export_all(self):
-        output_dir = "lts_automator_outputs"
-        try:
-            os.chdir(output_dir)
-        except Exception:
-            os.mkdir(output_dir)
-            os.chdir(output_dir)
-            print(f"Created new output directory ('{output_dir}') in: {os.getcwd()}")
-        cdir = '{}_{}'.format(self.fname.split(".")[0], dt.datetime.now().strftime("%Y%m%d-%H%M%S"))
-        os.mkdir(cdir)
-        os.chdir(cdir)
-        for count, t in enumerate(self.data_dict):
-            print("Exporting station '{}' ({}/{})...".format(t,
-                                                             count+1, 
-                                                             self.n_stations))
-            self.data_dict[t].export() 
+    def _output_path(self, output_dir = None, extensions = (".npz",)):
+        """Returns a new timestamped output path (without extension) in output_dir.
+
+        output_dir defaults to "lts_automator_outputs" next to the job file
+        and is created if needed.
+        """
+        if output_dir is None:
+            output_dir = os.path.join(os.path.dirname(self._abspath), "lts_automator_outputs")
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+            print(f"Created new output directory ('{output_dir}')")
+        base = os.path.join(output_dir, '{}_{}'.format(self.fname.split(".")[0], 
+                                                       dt.datetime.now().strftime("%Y%m%d-%H%M%S")))
+        cdir = base
+        # Outputs started within the same second get a numbered suffix
+        count = 1
+        while os.path.exists(cdir) or any(os.path.exists(cdir + ext) for ext in extensions):
+            count += 1
+            cdir = f"{base}_{count}"
+        return cdir
 
+
+    def export_all(self, output_dir = None, workers = None, threads = False, format = "csv", index = None):
+        """Exports every station and returns the path written to.
+
+        With format="csv" each station is written to its own CSV file in a
+        timestamped directory; with format="npz" the whole job is written to
+        a single timestamped archive that Job.load can memory-map. Output
+        goes inside output_dir, which defaults to "lts_automator_outputs"
+        next to the job file. With workers > 1 the CSV files are written from
+        a process pool (a thread pool if threads=True). If a SpatialIndex is
+        given the job is added to it and the index is saved alongside the
+        export (SpatialIndex.FNAME in the same directory).
+        """
+        start = time.perf_counter()
+        cdir = self._output_path(output_dir)
+        if format == "npz":
+            cdir = self.export_archive(cdir + ".npz")
+            self.metrics.add("export", time.perf_counter() - start, None, self._n_points(), 
+                             os.path.getsize(cdir))
+            print("Exported '{}' ({} stations) to '{}'".format(self.fname, self.n_stations, cdir))
+        elif format != "csv":
+            raise ValueError(f"Unknown export format '{format}' (expected 'csv' or 'npz')")
+        elif workers is not None and workers > 1:
+            os.mkdir(cdir)
+            stations = [self.data_dict[t] for t in self.station_list]
+            with make_pool(workers, threads) as pool:
+                fpaths = list(pool.map(export_frame, 
+                                       [s.df for s in stations], 
+                                       [s.export_path(cdir) for s in stations]))
+            self.metrics.add("export", time.perf_counter() - start, None, self._n_points(),
+                             sum(os.path.getsize(f) for f in fpaths))
+            print("Exported '{}' ({} stations)".format(self.fname, len(stations)))
+        else:
+            os.mkdir(cdir)
+            for count, t in enumerate(self.data_dict):
+                if self.quiet is False:
+                    print("Exporting station '{}' ({}/{})...".format(t,
+                                                                     count+1, 
+                                                                     self.n_stations))
+                self.data_dict[t].export(cdir)
+            self.metrics.add("export", time.perf_counter() - start, None, self._n_points(),
+                             sum(os.path.getsize(self.data_dict[t].export_path(cdir)) for t in self.station_list))
+            print("Exported '{}' ({} stations)".format(self.fname, self.n_stations))
+        if index is not None:
+            index.add_job(self)
+            index.save(os.path.join(os.path.dirname(cdir), SpatialIndex.FNAME))
+        return cdir
@@ -0,0 +1,72 @@
+"""
+==============================================================================
+synthetic_job
+------------------------------------------------------------------------------
+Writes synthetic Leica TCR-705 job files for benchmarking lts_processor.
+
+Each station is a straight transect across a channel with noisy banks, in
+the same layout as the field exports: a station header line, a blank line
+and then one line per surveyed point. With quirks enabled some headers are
+followed by two blank lines and some points carry a trailing code field,
+as real downloads do.
+
+Usage:
+    python synthetic_job.py job.txt --stations 1000 --points 100
+==============================================================================
+"""
+import argparse
+import numpy as np
+
+
+def iter_job_lines(n_stations, n_points, seed = 0, quirks = True):
+    """Yields the lines of a synthetic job file (without newlines)"""
+    if n_points < 4:
+        raise ValueError("Stations need at least four points to be read as survey data")
+    rng = np.random.default_rng(seed)
+    for s in range(n_stations):
+        easting, northing = 300000 + rng.uniform(0, 5000), 6200000 + rng.uniform(0, 5000)
+        elevation, height = 50 + rng.uniform(0, 20), 1.5 + rng.uniform(0, 0.2)
+        yield f"{s+1:05d}, {easting:.3f}, {northing:.3f}, {elevation:.3f}, {height:.3f}"
+        yield ""
+        if quirks and rng.random() < 0.2:
+            yield ""
+        # Transect across a parabolic channel between two floodplain benches
+        length = rng.uniform(20, 200)
+        angle = rng.uniform(0, 2 * np.pi)
+        centre, half_width = length * rng.uniform(0.3, 0.7), length * rng.uniform(0.1, 0.3)
+        depth = rng.uniform(0.5, 5)
+        chainage = np.sort(rng.uniform(0, length, n_points))
+        chainage[0] = 0
+        bed = np.clip(1 - ((chainage - centre) / half_width) ** 2, 0, None)
+        z = elevation - height - depth * bed + rng.normal(0, 0.05, n_points)
+        x = easting + chainage * np.cos(angle) + rng.normal(0, 0.01, n_points)
+        y = northing + chainage * np.sin(angle) + rng.normal(0, 0.01, n_points)
+        codes = rng.random(n_points) < 0.1 if quirks else np.zeros(n_points, dtype = bool)
+        for i in range(n_points):
+            line = f"{i+1}, {x[i]:.3f}, {y[i]:.3f}, {z[i]:.3f}, 1.300"
+            yield line + ", XS" if codes[i] else line
+        yield ""
+
+
+def write_job(fpath, n_stations, n_points, seed = 0, quirks = True):
+    """Writes a synthetic job file and returns its path"""
+    with open(fpath, "w") as file:
+        for line in iter_job_lines(n_stations, n_points, seed, quirks):
+            file.write(line + "\n")
+    return fpath
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Write a synthetic TCR-705 job file")
+    parser.add_argument("output", help = "job file to write")
+    parser.add_argument("--stations", type = int, default = 100, help = "number of stations")
+    parser.add_argument("--points", type = int, default = 100, help = "points per station")
+    parser.add_argument("--seed", type = int, default = 0, help = "random seed")
+    parser.add_argument("--no-quirks", action = "store_true", help = "write a perfectly regular file")
+    args = parser.parse_args(argv)
+    write_job(args.output, args.stations, args.points, args.seed, not args.no_quirks)
+    print("Wrote '{}' ({} stations x {} points)".format(args.output, args.stations, args.points))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+import os
+import sys
+import pytest
+
+# The modules live at the top of the repository rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic_job import write_job
+
+
+@pytest.fixture
+def job_file(tmp_path):
+    """A small synthetic TCR-705 job: 5 stations of 20 points"""
+    return write_job(str(tmp_path / "job.txt"), 5, 20)
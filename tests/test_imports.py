@@ -0,0 +1,17 @@
+import subprocess
+import pytest
+import benchmark
+
+
+@pytest.mark.parametrize("module", sorted(benchmark.IMPORT_BUDGETS))
+def test_import_budget(module):
+    try:
+        seconds, eager = benchmark.import_time(module, runs = 3)
+    except subprocess.CalledProcessError as error:
+        pytest.skip(error.stderr.strip().splitlines()[-1])
+    assert eager == [], "imports {} eagerly".format(", ".join(eager))
+    assert seconds <= benchmark.IMPORT_BUDGETS[module]
+
+
+def test_eager_import_is_reported():
+    assert benchmark.import_time("pandas", runs = 1)[1] == ["pandas"]
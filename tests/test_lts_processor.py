@@ -0,0 +1,223 @@
+import types
+import warnings
+import numpy as np
+import pytest
+import lts_processor as lp
+
+
+NEW_STATION = ("99999, 300000.000, 6200000.000, 60.000, 1.500\n\n"
+               "1, 300000.000, 6200000.000, 58.000, 1.300\n"
+               "2, 300001.000, 6200000.000, 57.000, 1.300\n"
+               "3, 300002.000, 6200000.000, 56.500, 1.300\n"
+               "4, 300003.000, 6200000.000, 57.500, 1.300\n")
+
+
+def same_arrays(job, other, names = ("cum_distance", "elevation")):
+    a_offsets, a = job.arrays(list(names))
+    b_offsets, b = other.arrays(list(names))
+    return (job.station_list == other.station_list and np.array_equal(a_offsets, b_offsets) 
+            and all(np.allclose(a[n], b[n], equal_nan = True) for n in names))
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_refresh_leaves_partial_line(job_file, columnar):
+    job = lp.Job(job_file, columnar = columnar, quiet = True)
+    job.process_all()
+    with open(job_file, "a") as file:
+        file.write(NEW_STATION + "5, 300004.0")
+    assert job.refresh() == ["99999"]
+    assert len(job.data_dict["99999"].df) == 4
+    with open(job_file, "a") as file:
+        file.write("00, 6200000.000, 58.000, 1.300\n\n")
+    assert job.refresh() == ["99999"]
+    assert len(job.data_dict["99999"].df) == 5
+    assert same_arrays(job, lp.Job(job_file, columnar = columnar, quiet = True))
+
+
+def corrections_for(job, stations):
+    first = {t: job.data_dict[t].df.iloc[0] for t in stations}
+    return lp.pd.DataFrame({"station": stations,
+                            "easting": [first[t]["easting"] + 10 for t in stations],
+                            "northing": [first[t]["northing"] - 5 for t in stations],
+                            "elevation": [first[t]["elevation"] + 1 for t in stations]})
+
+
+def test_correct_all_backends_agree(job_file):
+    eager = lp.Job(job_file, quiet = True)
+    columnar = lp.Job(job_file, columnar = True, quiet = True)
+    table = corrections_for(eager, eager.station_list[1:])
+    assert eager.correct_all(table) == columnar.correct_all(table) == [eager.station_list[0]]
+    for t in eager.station_list:
+        a, b = eager.data_dict[t].df, columnar.data_dict[t].df
+        assert [c for c in a if c.startswith("corrected_")] == [c for c in b if c.startswith("corrected_")]
+        assert np.allclose(a["corrected_easting"], b["corrected_easting"], equal_nan = True)
+    assert eager.data_dict[eager.station_list[0]].df["corrected_easting"].isna().all()
+    assert np.allclose(eager.data_dict["00002"].df["corrected_easting"] - eager.data_dict["00002"].df["easting"], 10)
+
+
+def test_corrections_keep_leading_zeros(job_file, tmp_path):
+    job = lp.Job(job_file, columnar = True, quiet = True)
+    fpath = str(tmp_path / "corrections.csv")
+    corrections_for(job, job.station_list).to_csv(fpath, index = False)
+    assert list(lp.read_corrections(fpath).index) == job.station_list
+    assert job.correct_all(fpath) == []
+
+
+def test_corrections_reject_numeric_station_ids(job_file):
+    job = lp.Job(job_file, quiet = True)
+    table = corrections_for(job, job.station_list)
+    table["station"] = table["station"].astype(int)
+    with pytest.raises(ValueError, match = "non-string station ID"):
+        job.correct_all(table)
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_non_numeric_fields_become_nan(job_file, columnar):
+    with open(job_file, "a") as file:
+        file.write("\n" + NEW_STATION.replace("3, 300002.000, 6200000.000, 56.500", "3a, 300002.000, 6200000.000, x"))
+    job = lp.Job(job_file, columnar = columnar, quiet = True)
+    df = job.data_dict["99999"].df
+    assert list(df["pt_id"].astype(str)) == ["1", "2", "3a", "4"]
+    assert df["elevation"].dtype == float
+    assert np.isnan(df["elevation"][2]) and df["elevation"][3] == 57.5
+    assert job.data_dict["00001"].df["pt_id"].dtype.kind == "i"
+
+
+def test_transect_distances_restart_at_each_transect():
+    rng = np.random.default_rng(0)
+    lengths = [5, 0, 1, 7, 0, 4]
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    easting = 300000 + np.cumsum(rng.uniform(0, 3, offsets[-1]))
+    northing = 6200000 + np.cumsum(rng.uniform(-1, 1, offsets[-1]))
+    northing[9] = np.nan
+    x_dist, cum_distance, mirrored, hd = lp.transect_distances(easting, northing, offsets)
+    for i, (start, stop) in enumerate(zip(offsets[:-1], offsets[1:])):
+        steps = np.hypot(np.diff(easting[start:stop]), np.diff(northing[start:stop]))
+        expected = np.concatenate([[0], np.cumsum(steps)])[:stop - start]
+        assert np.allclose(cum_distance[start:stop], expected, rtol = 0, atol = 1e-9, equal_nan = True)
+        assert hd[i] == pytest.approx(np.nanmax(expected) if stop > start else 0, abs = 1e-9)
+    # The NaN only spoils the rest of its own transect
+    assert np.isnan(cum_distance[9:13]).all() and not np.isnan(cum_distance[13:]).any()
+    assert np.allclose(mirrored, np.repeat(hd, lengths) - cum_distance, equal_nan = True)
+
+
+RESHOT = NEW_STATION.replace("99999", "00002")
+
+
+@pytest.mark.parametrize("options", [{}, {"columnar": True}, {"lazy": True}, {"lazy": True, "columnar": True}])
+def test_repeated_station_keeps_last_block(job_file, options):
+    with open(job_file, "a") as file:
+        file.write("\n" + RESHOT)
+    job = lp.Job(job_file, quiet = True, **options)
+    if options.get("lazy"):
+        # Streaming has already yielded the first block when the re-shot replaces it
+        streamed = ["00001", "00003", "00004", "00005", "00002"] if job.columnar else \
+                   ["00001", "00002", "00003", "00004", "00005", "00002"]
+        assert [s.station_id for s in job.iter_stations()] == streamed
+    assert job.station_list == ["00001", "00003", "00004", "00005", "00002"]
+    assert list(job.data_dict["00002"].df["elevation"]) == [58.0, 57.0, 56.5, 57.5]
+    job.process_all()
+    assert job.data_dict["00002"].df["cum_distance"].iloc[-1] == 3.0
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_refresh_replaces_reshot_station(job_file, columnar):
+    job = lp.Job(job_file, columnar = columnar, quiet = True)
+    job.process_all()
+    with open(job_file, "a") as file:
+        file.write("\n" + RESHOT + "\n")
+    assert job.refresh() == ["00002"]
+    assert len(job.data_dict["00002"].df) == 4
+    job.process_all()
+    fresh = lp.Job(job_file, columnar = columnar, quiet = True)
+    fresh.process_all()
+    assert same_arrays(job, fresh)
+
+
+class FrozenClock:
+    """Stands in for datetime.datetime so every export starts in the same second"""
+    moment = lp.dt.datetime(2024, 5, 1, 12, 0, 0)
+
+    @classmethod
+    def now(cls):
+        return cls.moment
+
+
+@pytest.mark.parametrize("format", ["csv", "npz"])
+def test_exports_in_the_same_second_get_numbered_names(job_file, tmp_path, monkeypatch, format):
+    monkeypatch.setattr(lp, "dt", types.SimpleNamespace(datetime = FrozenClock))
+    job = lp.Job(job_file, columnar = format == "npz", quiet = True)
+    job.process_all()
+    paths = [job.export_all(output_dir = str(tmp_path / "out"), format = format) for i in range(3)]
+    stem = str(tmp_path / "out" / "job_20240501-120000")
+    extension = ".npz" if format == "npz" else ""
+    assert paths == [stem + extension, stem + "_2" + extension, stem + "_3" + extension]
+    assert all(lp.os.path.exists(path) for path in paths)
+
+
+def test_rating_curves_blocks_agree():
+    rng = np.random.default_rng(3)
+    lengths = [40, 0, 2, 300, 25]
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    x = np.concatenate([np.sort(rng.uniform(0, 50, n)) for n in lengths])
+    y = rng.uniform(0, 5, offsets[-1])
+    y[offsets[3] + 10:offsets[3] + 20] = 2.0
+    stages = np.tile(np.linspace(0, 5, 30), (len(lengths), 1))
+    whole = lp.rating_curves(x, y, stages, offsets)
+    # Blocks of transects, then blocks of stages within the longest transect
+    for max_block in (1000, 50, 1):
+        blocked = lp.rating_curves(x, y, stages, offsets, max_block = max_block)
+        for name in whole:
+            assert np.allclose(blocked[name], whole[name], equal_nan = True)
+
+
+def test_rating_curves_flat_bed_without_warnings():
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        curve = lp.rating_curves([0, 1, 2, 3, 4], [2, 1, 1, 1, 2], [1.0, 1.5, 2.0])
+    assert np.allclose(curve["area"][0], [0, 1.25, 3])
+    assert np.allclose(curve["top_width"][0], [2, 3, 4])
+
+
+def test_rating_curves_of_stations_processed_one_by_one(job_file):
+    job = lp.Job(job_file, columnar = True, quiet = True)
+    for t in job.station_list:
+        job.data_dict[t].process()
+    table = job.rating_curves(0.035, 0.001, n_stages = 5)
+    assert len(table) == 5 * job.n_stations
+
+
+def test_chainage_grid_n_points_ends_at_the_end():
+    rng = np.random.default_rng(0)
+    starts = rng.uniform(0, 1000, 1000)
+    ends = starts + rng.uniform(0, 500, 1000)
+    chainage, offsets = lp.chainage_grid(starts, ends, n_points = 7)
+    assert (np.diff(offsets) == 7).all()
+    assert np.array_equal(chainage[offsets[1:] - 1], ends)
+    x = np.concatenate([[start, end] for start, end in zip(starts, ends)])
+    offsets = np.arange(0, 2001, 2)
+    chainage, values, new_offsets, fixed = lp.resample_transects(x, {"x": x}, offsets, n_points = 7)
+    assert (np.diff(new_offsets) == 7).all()
+    with pytest.raises(ValueError):
+        lp.chainage_grid([0.0], [1.0], n_points = 1)
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_resample_to_n_points(job_file, columnar):
+    job = lp.Job(job_file, columnar = columnar, quiet = True)
+    resampled = job.resample(n_points = 13)
+    for t in job.station_list:
+        df = resampled.data_dict[t].df
+        assert len(df) == 13
+        assert df["cum_distance"].iloc[-1] == job.data_dict[t].df["cum_distance"].max()
+
+
+@pytest.mark.parametrize("options", [{}, {"workers": 2, "threads": True}])
+def test_export_all_writes_each_station_once(job_file, tmp_path, options):
+    job = lp.Job(job_file, quiet = True)
+    job.process_all()
+    cdir = job.export_all(output_dir = str(tmp_path / "out"), index = lp.SpatialIndex(), **options)
+    assert sorted(lp.os.listdir(cdir)) == sorted(lp.os.path.basename(job.data_dict[t].export_path(cdir))
+                                                 for t in job.station_list)
+    assert [record[:2] for record in job.metrics.records].count(("export", None)) == 1
+    assert lp.os.path.exists(str(tmp_path / "out" / lp.SpatialIndex.FNAME))
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+import xsec_analysis as xa
+
+
+def noisy_profile(n, seed = 0):
+    rng = np.random.default_rng(seed)
+    x = np.sort(rng.uniform(0, 1000, n))
+    x[0], x[-1] = 0, 1000
+    return x, np.abs(x - 500) / 50 + rng.normal(0, 0.05, n)
+
+
+@pytest.mark.parametrize("n", [50, 5000, 100000])
+def test_hydraulics_matches_clipped(n):
+    x, y = noisy_profile(n)
+    geometry = xa.ChannelGeometry(x, y)
+    rng = np.random.default_rng(1)
+    for q in range(100):
+        xl, xr = np.sort(rng.uniform(0, 1000, 2))
+        stage = None if q % 2 else rng.uniform(y.min() - 1, y.max() + 1)
+        flow = geometry.hydraulics(xl, xr, stage)
+        expected = geometry._clipped(xl, geometry.bed(xl), xr, geometry.bed(xr), flow["stage"])
+        for name, value in expected.items():
+            assert flow[name] == pytest.approx(value, rel = 1e-9, abs = 1e-9), name
+
+
+def test_bankfull_on_noisy_bed_uses_block_sums(monkeypatch):
+    # The default stage crosses a noisy bed many times near the banks
+    x, y = noisy_profile(100000)
+    geometry = xa.ChannelGeometry(x, y)
+    monkeypatch.setattr(geometry, "_clipped", None)
+    flow = geometry.hydraulics(100, 900)
+    assert geometry._sums is not None
+    assert flow["top_width"] == pytest.approx(800, rel = 0.01)
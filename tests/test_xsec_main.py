@@ -0,0 +1,155 @@
+import time
+import numpy as np
+import pytest
+
+xm = pytest.importorskip("xsec_main")
+from xsec_analysis import ChannelGeometry
+
+
+class Var:
+    """Stands in for a Tk variable, as the tests run without a display"""
+    def __init__(self, value = 0.0):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
+
+
+class Entry(Var):
+    pass
+
+
+@pytest.fixture
+def app():
+    app = xm.App.__new__(xm.App)
+    app.tk_vars = {name: Var() for name in ("tkv_DISCHARGE", "tkv_FLOWVELOCITY", "tkv_SLOPE", "tkv_MANNINGS",
+                                            "tkv_LHB_x", "tkv_RHB_x", "tkv_STATUS")}
+    app.entry_MANNINGS = Entry("0.035")
+    app.entry_SLOPE = Entry("0.001")
+    app.channel_geometry = None
+    app.scheduled = []
+    app.after = lambda delay, callback: app.scheduled.append(callback)
+    app._worker_queue = xm.queue.Queue()
+    app._worker_id = 0
+    app._workers = {}
+    app._polling = False
+    return app
+
+
+def v_channel(app):
+    x = np.linspace(0, 10, 11)
+    app.channel_geometry = ChannelGeometry(x, np.abs(x - 5))
+    app.tk_vars["tkv_LHB_x"].set(0.0)
+    app.tk_vars["tkv_RHB_x"].set(10.0)
+
+
+@pytest.mark.parametrize("button", ["press_discharge_button", "show_rating_curve"])
+@pytest.mark.parametrize("entry", ["entry_MANNINGS", "entry_SLOPE"])
+def test_flow_buttons_report_bad_entries(app, button, entry):
+    v_channel(app)
+    getattr(app, entry).set("")
+    getattr(app, button)()
+    assert "must be numbers" in app.tk_vars["tkv_STATUS"].get()
+    assert app.tk_vars["tkv_DISCHARGE"].get() == 0.0
+
+
+@pytest.mark.parametrize("button", ["press_discharge_button", "show_rating_curve"])
+def test_flow_buttons_need_a_profile(app, button):
+    getattr(app, button)()
+    assert app.tk_vars["tkv_STATUS"].get() == "Load a profile first"
+
+
+def test_discharge_button(app):
+    v_channel(app)
+    app.tk_vars["tkv_STATUS"].set("Manning's n and slope must be numbers")
+    app.press_discharge_button()
+    assert app.tk_vars["tkv_STATUS"].get() == ""
+    assert app.tk_vars["tkv_MANNINGS"].get() == 0.035
+    # Bankfull V channel: area 25, wetted perimeter 10 * sqrt(2)
+    velocity = 0.035 ** -1 * (25 / (10 * 2 ** 0.5)) ** (2 / 3) * 0.001 ** 0.5
+    assert app.tk_vars["tkv_FLOWVELOCITY"].get() == pytest.approx(velocity, abs = 1e-4)
+    assert app.tk_vars["tkv_DISCHARGE"].get() == pytest.approx(25 * velocity, rel = 1e-3)
+
+
+def test_profile_geometry_does_not_shadow_window_geometry(app):
+    x = np.linspace(0, 10, 11)
+    app.load_data(x, np.abs(x - 5))
+    assert isinstance(app.channel_geometry, ChannelGeometry)
+    assert "geometry" not in vars(app)
+    assert xm.App.geometry is xm.tk.Tk.geometry
+
+
+def test_new_window_has_no_profile_geometry():
+    try:
+        app = xm.App()
+    except xm.tk.TclError:
+        pytest.skip("no display")
+    try:
+        assert app.channel_geometry is None
+        app.geometry("800x600")
+    finally:
+        app.destroy()
+
+
+def test_detect_banks_before_a_profile_is_loaded(app):
+    app.tk_vars["tkv_AUTOBANKS"] = Var("wd_ratio")
+    app.detect_banks()
+    assert app._workers == {} and app.scheduled == []
+
+
+def test_detected_banks_of_an_old_profile_are_dropped(app):
+    v_channel(app)
+    old = app.channel_geometry
+    v_channel(app)
+    app.place_detected_banks(old, 1.0, 9.0)
+    assert app.tk_vars["tkv_LHB_x"].get() == 0.0
+
+
+def run_polls(app, n_messages):
+    """Waits for the workers to post n_messages, then runs the scheduled polls"""
+    deadline = time.time() + 5
+    while app._worker_queue.qsize() < n_messages and time.time() < deadline:
+        time.sleep(0.01)
+    while app.scheduled:
+        app.scheduled.pop(0)()
+
+
+def test_background_jobs_with_other_labels_carry_on(app):
+    results = []
+    app.run_in_background(lambda progress: "profile", results.append, "Loading")
+    app.run_in_background(lambda progress: "banks", results.append, "Detecting banks")
+    run_polls(app, 2)
+    assert sorted(results) == ["banks", "profile"]
+    assert app._workers == {} and app._polling is False
+
+
+def test_background_job_replaces_one_with_the_same_label(app):
+    results = []
+    app.run_in_background(lambda progress: "old", results.append, "Loading")
+    app.run_in_background(lambda progress: "new", results.append, "Loading")
+    run_polls(app, 2)
+    assert results == ["new"]
+
+
+def test_polling_continues_after_a_failing_callback(app):
+    results = []
+    release = xm.threading.Event()
+
+    def fail(result):
+        raise RuntimeError("callback failed")
+
+    app.run_in_background(lambda progress: "first", fail, "Loading")
+    app.run_in_background(lambda progress: release.wait(5) and "second", results.append, "Detecting banks")
+    deadline = time.time() + 5
+    while app._worker_queue.empty() and time.time() < deadline:
+        time.sleep(0.01)
+    with pytest.raises(RuntimeError):
+        app.scheduled.pop(0)()
+    # The other job is still polled for
+    assert len(app.scheduled) == 1
+    release.set()
+    run_polls(app, 1)
+    assert results == ["second"] and app._polling is False
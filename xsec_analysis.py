@@ -0,0 +1,681 @@
+"""
+==============================================================================
+xsec_analysis v0.2.0
+------------------------------------------------------------------------------
+Headless cross-section analysis shared by the xsec_main GUI and batch runs.
+
+Command line:
+    python xsec_analysis.py station_*.csv job.txt -o results.csv --workers 8
+    python xsec_analysis.py --manifest manifest.csv --mannings 0.035 --slope 0.001
+
+Inputs can be profile CSV files, TCR-705 job files or .npz job archives
+written by lts_processor. A manifest is a CSV with a "path" column and
+optional "station", "lhb" and "rhb" columns giving bank chainages; profiles
+without banks use the --banks rule: "ends", "thalweg" (the highest points
+either side of the thalweg) or an automatic bankfull detection, "wd_ratio"
+(minimum width/depth ratio) or "curvature" (sharpest bend of area against
+stage), which scans --stages water levels per profile. Results for every
+profile are written to one table.
+==============================================================================
+"""
+import argparse
+import os
+import numpy as np
+import lts_processor as lp
+
+pd = lp.LazyModule("pandas")
+
+
+def poly_area(x, y):
+    """Shoelace area of the polygon with vertices x, y"""
+    return 0.5*np.abs(np.dot(x,np.roll(y,1))-np.dot(y,np.roll(x,1)))
+
+
+class SortedLookup:
+    """Sorted index over a profile for O(log n) snapping and interpolation.
+
+    keys are sorted once (stably, so repeated keys keep their original
+    order) and values are reordered to match, so duplicate keys no longer
+    resolve to the wrong value the way list.index() lookups did.
+    """
+    def __init__(self, keys, values):
+        keys = np.asarray(keys, dtype = float)
+        values = np.asarray(values, dtype = float)
+        order = np.argsort(keys, kind = "stable")
+        self.keys = keys[order]
+        self.values = values[order]
+
+    def nearest(self, v):
+        """Returns (key, value) of the point whose key is nearest to v"""
+        i = int(np.searchsorted(self.keys, v))
+        if i == len(self.keys) or (i > 0 and v - self.keys[i-1] <= self.keys[i] - v):
+            i -= 1
+        return self.keys[i], self.values[i]
+
+    def surrounding(self, v):
+        """Returns the indices of the nearest keys strictly below and above v"""
+        lo = int(np.searchsorted(self.keys, v, side = "left")) - 1
+        hi = int(np.searchsorted(self.keys, v, side = "right"))
+        if lo < 0 or hi >= len(self.keys):
+            raise ValueError(f"{v} is outside the range of the profile")
+        return lo, hi
+
+    def interpolate(self, v):
+        """Linearly interpolates the value at key v"""
+        i = int(np.searchsorted(self.keys, v, side = "left"))
+        if i < len(self.keys) and self.keys[i] == v:
+            return self.values[i]
+        lo, hi = self.surrounding(v)
+        x1, x2 = self.keys[lo], self.keys[hi]
+        y1, y2 = self.values[lo], self.values[hi]
+        slope = (y2 - y1) / (x2 - x1)
+        intercept = y1 - slope * x1
+        return slope * v + intercept
+
+
+class ChannelGeometry:
+    """Channel geometry queries over one profile using prefix sums.
+
+    The profile is sorted by x once, and cumulative trapezoid areas under
+    the bed, cumulative bed lengths and sparse tables of range minima and
+    maxima are precomputed. Area, wetted perimeter, hydraulic radius and
+    top width for any bank pair and stage then come back in O(log n) when
+    the water between the banks is one run. A stage that leaves parts of the
+    bed dry in between (a mid-channel bar, or a noisy bed near the stage) is
+    answered from per-segment sums sorted by elevation within blocks of
+    about sqrt(n) segments (see _BlockSums), in O(sqrt(n) log n). They are
+    built the first time they are needed. Water above the bed at a bank
+    line is treated as held by a vertical line at the bank, which is not
+    counted as wetted.
+    """
+    def __init__(self, x, y):
+        x = np.asarray(x, dtype = float)
+        y = np.asarray(y, dtype = float)
+        if len(x) < 2:
+            raise ValueError("A profile needs at least two points")
+        order = np.argsort(x, kind = "stable")
+        self.x = x[order]
+        self.y = y[order]
+        dx = np.diff(self.x)
+        dy = np.diff(self.y)
+        self.cum_area = np.concatenate([[0], np.cumsum(dx * (self.y[:-1] + self.y[1:]) / 2)])
+        self.cum_length = np.concatenate([[0], np.cumsum(np.hypot(dx, dy))])
+        self._min_table = self._sparse_table(self.y, np.minimum)
+        self._max_table = self._sparse_table(self.y, np.maximum)
+        # Built by _segment_sums, with elevations relative to _y0
+        self._sums = None
+        self._y0 = self.y.min()
+
+    @staticmethod
+    def _sparse_table(values, op):
+        # Level j holds op over every window of 2**j consecutive values
+        table = [values]
+        k = 1
+        while 2 * k <= len(values):
+            table.append(op(table[-1][:-k], table[-1][k:]))
+            k *= 2
+        return table
+
+    @staticmethod
+    def _range(table, op, lo, hi):
+        """op over values[lo:hi] (hi > lo) in O(1)"""
+        j = (hi - lo).bit_length() - 1
+        return op(table[j][lo], table[j][hi - (1 << j)])
+
+    def bed(self, x):
+        """Bed elevation at x, interpolated linearly between survey points"""
+        i = min(max(int(np.searchsorted(self.x, x, side = "right")) - 1, 0), len(self.x) - 2)
+        x1, x2 = self.x[i], self.x[i+1]
+        if x2 == x1:
+            return self.y[i+1]
+        return self.y[i] + (self.y[i+1] - self.y[i]) * (x - x1) / (x2 - x1)
+
+    def interior(self, xl, xr):
+        """Index range [lo, hi) of the survey points strictly between xl and xr"""
+        return (int(np.searchsorted(self.x, xl, side = "right")), 
+                int(np.searchsorted(self.x, xr, side = "left")))
+
+    @staticmethod
+    def _trapezoid(x1, y1, x2, y2):
+        return (x2 - x1) * (y1 + y2) / 2
+
+    @staticmethod
+    def _segment(x1, y1, x2, y2):
+        return np.hypot(x2 - x1, y2 - y1)
+
+    def _integrate(self, cum, segment, xl, yl, lo, hi, xr, yr):
+        """Sums segment over (xl, yl), the points [lo, hi) and (xr, yr)"""
+        if hi <= lo:
+            return segment(xl, yl, xr, yr)
+        return (segment(xl, yl, self.x[lo], self.y[lo]) + cum[hi-1] - cum[lo] 
+                + segment(self.x[hi-1], self.y[hi-1], xr, yr))
+
+    def bed_area(self, xl, yl, xr, yr):
+        """Area under the bed from (xl, yl) to (xr, yr)"""
+        return self._integrate(self.cum_area, self._trapezoid, xl, yl, *self.interior(xl, xr), xr, yr)
+
+    def bed_length(self, xl, yl, xr, yr):
+        """Length along the bed from (xl, yl) to (xr, yr)"""
+        return self._integrate(self.cum_length, self._segment, xl, yl, *self.interior(xl, xr), xr, yr)
+
+    def polygon(self, xl, yl, xr, yr):
+        """Vertices of the channel polygon between the two bank points"""
+        lo, hi = self.interior(xl, xr)
+        return (np.concatenate([[xl], self.x[lo:hi], [xr]]), 
+                np.concatenate([[yl], self.y[lo:hi], [yr]]))
+
+    def polygon_area(self, xl, yl, xr, yr):
+        """Area between the bed and the straight line joining the bank points.
+
+        Equal to the shoelace area of polygon(), computed from prefix sums.
+        """
+        return abs((xr - xl) * (yl + yr) / 2 - self.bed_area(xl, yl, xr, yr))
+
+    def min_between(self, xl, yl, xr, yr):
+        """Lowest bed elevation between and including the bank points"""
+        lo, hi = self.interior(xl, xr)
+        lowest = min(yl, yr)
+        if hi > lo:
+            lowest = min(lowest, self._range(self._min_table, np.minimum, lo, hi))
+        return lowest
+
+    def bank_metrics(self, xl, yl, xr, yr):
+        """Width, bankfull depth, W/D ratio and polygon area for a bank pair"""
+        width = xr - xl
+        depth = min(yl, yr) - self.min_between(xl, yl, xr, yr)
+        return {"width": width,
+                "depth": depth,
+                "wd_ratio": width / depth if depth > 0 else float("nan"),
+                "area": self.polygon_area(xl, yl, xr, yr)}
+
+    def hydraulics(self, xl, xr, stage = None):
+        """Flow geometry between banks at xl and xr for a water surface at stage.
+
+        stage defaults to bankfull at the lower bank. Returns a dict with
+        stage, area, wetted_perimeter, hydraulic_radius, top_width and
+        max_depth.
+        """
+        yl, yr = self.bed(xl), self.bed(xr)
+        if stage is None:
+            stage = min(yl, yr)
+        lo, hi = self.interior(xl, xr)
+        if hi <= lo or self._range(self._min_table, np.minimum, lo, hi) >= stage:
+            return self._runs(xl, yl, xr, yr, stage, lo, hi)
+        # First and last interior points below the stage (binary search on range minima)
+        i = self._search(lo, hi, lambda m: self._range(self._min_table, np.minimum, lo, m + 1) < stage)
+        j = self._search(lo, hi, lambda m: not self._range(self._min_table, np.minimum, m, hi) < stage) - 1
+        contiguous = (self._range(self._max_table, np.maximum, i, j + 1) <= stage
+                      and (yl > stage or i == lo) and (yr > stage or j == hi - 1))
+        if not contiguous:
+            return self._runs(xl, yl, xr, yr, stage, lo, hi)
+        # Edges of the water surface: the bank line if the bed there is below
+        # the stage, otherwise where the bed crosses the stage
+        if yl <= stage:
+            el, ely = xl, yl
+        else:
+            px, py = (self.x[i-1], self.y[i-1]) if i > lo else (xl, yl)
+            el, ely = px + (py - stage) * (self.x[i] - px) / (py - self.y[i]), stage
+        if yr <= stage:
+            er, ery = xr, yr
+        else:
+            px, py = (self.x[j+1], self.y[j+1]) if j < hi - 1 else (xr, yr)
+            er, ery = px - (py - stage) * (px - self.x[j]) / (py - self.y[j]), stage
+        lowest = self._range(self._min_table, np.minimum, i, j + 1)
+        area = stage * (er - el) - self._integrate(self.cum_area, self._trapezoid, el, ely, i, j + 1, er, ery)
+        wetted_perimeter = self._integrate(self.cum_length, self._segment, el, ely, i, j + 1, er, ery)
+        return self._result(stage, area, wetted_perimeter, er - el, stage - min(lowest, ely, ery))
+
+    @staticmethod
+    def _search(lo, hi, condition):
+        """Smallest m in [lo, hi) for which the monotonic condition holds (hi if none)"""
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if condition(mid):
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def _clipped(self, xl, yl, xr, yr, stage):
+        """Exact flow geometry from the points between the banks, O(k)"""
+        xs, ys = self.polygon(xl, yl, xr, yr)
+        return self._result(stage, *self._clip(xs, ys, stage), max(stage - ys.min(), 0))
+
+    @staticmethod
+    def _clip(xs, ys, stage):
+        """(area, wetted perimeter, top width) of the water below stage over a polyline"""
+        d1 = stage - ys[:-1]
+        d2 = stage - ys[1:]
+        dx = np.diff(xs)
+        seg_length = np.hypot(dx, np.diff(ys))
+        wet = (d1 >= 0) & (d2 >= 0)
+        partial = ~wet & ((d1 > 0) | (d2 > 0))
+        deepest = np.maximum(d1, d2)
+        # Wet fraction of each segment that crosses the water surface
+        fraction = np.where(wet, 1.0, 0.0)
+        fraction[partial] = deepest[partial] / np.abs(d1 - d2)[partial]
+        area = np.where(wet, dx * (d1 + d2) / 2, fraction * dx * deepest / 2).sum()
+        return area, (fraction * seg_length).sum(), (fraction * dx).sum()
+
+    def _runs(self, xl, yl, xr, yr, stage, lo, hi):
+        """Flow geometry when the water between the banks is not one run.
+
+        The segments between interior points that make up whole blocks of
+        _segment_sums are summed from it; the rest are clipped directly.
+        """
+        sums = self._segment_sums()
+        b0, b1 = -(-lo // sums.size), (hi - 1) // sums.size
+        if b1 <= b0:
+            return self._clipped(xl, yl, xr, yr, stage)
+        first, last = b0 * sums.size, b1 * sums.size
+        head = self._clip(np.concatenate([[xl], self.x[lo:first+1]]), 
+                          np.concatenate([[yl], self.y[lo:first+1]]), stage)
+        tail = self._clip(np.concatenate([self.x[last:hi], [xr]]), 
+                          np.concatenate([self.y[last:hi], [yr]]), stage)
+        # Segments wholly under water (top <= stage) and, by difference, those
+        # crossing it (bottom < stage < top); see _segment_sums for the terms
+        s = stage - self._y0
+        below = sums.below(b0, b1, s)
+        wet = sums.below(b0, b1, s, top = True)
+        dx, trapezoid, length = wet[:3]
+        c, c_bottom, c_bottom2, p, p_bottom = below - wet[3:]
+        area = s * dx - trapezoid + s * s * c - 2 * s * c_bottom + c_bottom2
+        wetted_perimeter = length + s * p - p_bottom
+        top_width = dx + 2 * (s * c - c_bottom)
+        lowest = min(yl, yr, self._range(self._min_table, np.minimum, lo, hi))
+        return self._result(stage, head[0] + area + tail[0], head[1] + wetted_perimeter + tail[1], 
+                            head[2] + top_width + tail[2], max(stage - lowest, 0))
+
+    def _segment_sums(self):
+        """_BlockSums over the segments between survey points, built on first use.
+
+        Elevations are taken relative to the lowest point. A segment from
+        bottom b to top t with run dx and length L adds, while wholly under
+        water at stage s, s dx - dx (b + t) / 2 to the area, L to the wetted
+        perimeter and dx to the top width; while crossing the water surface
+        it adds c (s - b)**2, p (s - b) and 2 c (s - b), with c = dx / 2(t - b)
+        and p = L / (t - b). Expanding the squares leaves sums of fixed terms
+        that are multiplied by powers of s. Segments that are level to
+        rounding never count as crossing.
+        """
+        if self._sums is None:
+            y1 = self.y[:-1] - self._y0
+            y2 = self.y[1:] - self._y0
+            dx = np.diff(self.x)
+            length = np.hypot(dx, y2 - y1)
+            bottom, top = np.minimum(y1, y2), np.maximum(y1, y2)
+            rise = top - bottom
+            sloped = rise > 1e-9 * max(top.max(initial = 0), 1)
+            c = np.where(sloped, dx / (2 * np.where(sloped, rise, 1)), 0)
+            p = np.where(sloped, length / np.where(sloped, rise, 1), 0)
+            crossing = [c, c * bottom, c * bottom ** 2, p, p * bottom]
+            size = max(int(np.sqrt(len(dx))), 16)
+            self._sums = _BlockSums(bottom, top, [dx, dx * (y1 + y2) / 2, length], crossing, size)
+        return self._sums
+
+    @staticmethod
+    def _result(stage, area, wetted_perimeter, top_width, max_depth):
+        return {"stage": stage,
+                "area": area,
+                "wetted_perimeter": wetted_perimeter,
+                "hydraulic_radius": area / wetted_perimeter if wetted_perimeter > 0 else 0.0,
+                "top_width": top_width,
+                "max_depth": max_depth}
+
+
+class _BlockSums:
+    """Sums over whole blocks of segments whose bottom or top is below a level.
+
+    Segments are taken in blocks of size. Within each block they are sorted
+    by bottom (and separately by top) elevation and their terms summed
+    cumulatively in that order, so the sums over a run of blocks take one
+    binary search per block. below(b0, b1, level) sums the crossing terms
+    of the segments in blocks [b0, b1) with bottom < level; with top=True it
+    sums the wet terms and then the crossing terms of those with top <= level.
+    """
+    def __init__(self, bottom, top, wet, crossing, size):
+        self.size = size
+        self._bottom = self._sorted_sums(bottom, crossing)
+        self._top = self._sorted_sums(top, wet + crossing)
+
+    def _sorted_sums(self, keys, columns):
+        n_blocks = len(keys) // self.size
+        n = n_blocks * self.size
+        sorted_keys = np.sort(keys)
+        # Ranks are exact, so blocks can be searched together in one array
+        # of rank + block * stride
+        rank = np.searchsorted(sorted_keys, keys[:n], side = "left").reshape(n_blocks, self.size)
+        order = np.argsort(rank, axis = 1, kind = "stable")
+        stride = len(keys) + 1
+        ranks = (np.take_along_axis(rank, order, axis = 1) + stride * np.arange(n_blocks)[:, None]).ravel()
+        cum = np.zeros((n_blocks, self.size + 1, len(columns)))
+        for i, column in enumerate(columns):
+            np.cumsum(np.take_along_axis(column[:n].reshape(n_blocks, self.size), order, axis = 1), 
+                      axis = 1, out = cum[:, 1:, i])
+        return sorted_keys, ranks, stride, cum
+
+    def below(self, b0, b1, level, top = False):
+        sorted_keys, ranks, stride, cum = self._top if top else self._bottom
+        rank = np.searchsorted(sorted_keys, level, side = "right" if top else "left")
+        blocks = np.arange(b0, b1)
+        count = np.searchsorted(ranks, rank + stride * blocks) - self.size * blocks
+        return cum[blocks, count].sum(axis = 0)
+
+
+def banks_at_ends(geometry):
+    """Banks at the first and last survey points"""
+    return geometry.x[0], geometry.x[-1]
+
+
+def banks_at_thalweg_maxima(geometry):
+    """Banks at the highest points either side of the thalweg"""
+    thalweg = int(np.argmin(geometry.y))
+    left = int(np.argmax(geometry.y[:thalweg+1]))
+    right = thalweg + int(np.argmax(geometry.y[thalweg:]))
+    return geometry.x[left], geometry.x[right]
+
+
+def thalweg_banks(x, y, offsets):
+    """banks_at_thalweg_maxima for many profiles at once.
+
+    x and y hold the profiles back to back, each sorted by x, with offsets
+    as in lts_processor.transect_distances. Returns the indices of the left
+    and right bank points (-1 for empty profiles).
+    """
+    y = np.asarray(y, dtype = float)
+    offsets = np.asarray(offsets, dtype = np.int64)
+    lengths = np.diff(offsets)
+    has_points = lengths > 0
+    profile = np.repeat(np.arange(len(lengths)), lengths)
+    index = np.arange(len(y))
+    left = np.full(len(lengths), -1, dtype = np.int64)
+    right = np.full(len(lengths), -1, dtype = np.int64)
+    if not has_points.any():
+        return left, right
+    # lexsort is stable, so ties go to the first point as with argmin/argmax
+    starts = offsets[:-1][has_points]
+    thalweg = np.full(len(lengths), -1, dtype = np.int64)
+    thalweg[has_points] = np.lexsort((y, profile))[starts]
+    for side, out in ((index <= thalweg[profile], left), (index >= thalweg[profile], right)):
+        order = np.lexsort((-y[side], profile[side]))
+        group = profile[side][order]
+        first = np.concatenate([[True], group[1:] != group[:-1]])
+        out[group[first]] = index[side][order][first]
+    return left, right
+
+
+def min_wd_ratio(stages, curves):
+    """Stage at which the width/depth ratio stops falling and starts to rise.
+
+    Mean depth is area / top width, so W/D is top_width**2 / area.
+    """
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        ratio = curves["top_width"] ** 2 / curves["area"]
+    return np.argmin(np.where(curves["area"] > 0, ratio, np.inf), axis = 1)
+
+
+def max_area_curvature(stages, curves):
+    """Stage at which area bends upwards most sharply against stage.
+
+    The second difference of area is the growth of top width per step, so
+    the bend is where the water starts to spread out of the channel; the
+    stage just below it is returned. Top width keeps growing at that rate
+    over a planar floodplain, so the first stage within rounding of the
+    sharpest bend is taken. Profiles without a bend (e.g. a plain V) keep
+    the top stage. The dry bottom stage is never picked.
+    """
+    curvature = np.diff(curves["area"], n = 2, axis = 1)[:, 1:]
+    sharpest = curvature.max(axis = 1, keepdims = True)
+    index = np.argmax(curvature >= sharpest - 1e-9 * np.abs(sharpest), axis = 1)
+    no_bend = (sharpest[:, 0] - curvature.min(axis = 1)) <= 1e-6 * np.abs(sharpest[:, 0])
+    return np.where(no_bend, stages.shape[1] - 1, index + 1)
+
+
+# Criteria for detect_banks: f(stages, rating_curves dict) -> stage index per profile
+BANK_CRITERIA = {"wd_ratio": min_wd_ratio,
+                 "curvature": max_area_curvature}
+
+
+def detect_banks(x, y, offsets, criterion = "wd_ratio", n_stages = 100):
+    """Bank positions of many profiles from a sweep of water levels.
+
+    x and y hold the profiles back to back, each sorted by x, with offsets
+    as for thalweg_banks. Each profile is cut to the stretch between the
+    highest points either side of its thalweg, and flow geometry for
+    n_stages water levels from the thalweg up to the lower of those points
+    comes from one lp.rating_curves call over every profile. The named
+    criterion in BANK_CRITERIA picks the bankfull stage, and the banks are
+    where that water surface meets the bed either side of the thalweg.
+    Returns (lhb_x, rhb_x, stage) arrays, NaN for profiles without a
+    channel.
+    """
+    if criterion not in BANK_CRITERIA:
+        raise ValueError(f"Unknown criterion '{criterion}' (expected one of {sorted(BANK_CRITERIA)})")
+    if n_stages < 4:
+        raise ValueError("At least 4 stages are needed to detect banks")
+    x = np.asarray(x, dtype = float)
+    y = np.asarray(y, dtype = float)
+    offsets = np.asarray(offsets, dtype = np.int64)
+    n = len(offsets) - 1
+    lhb_x = np.full(n, np.nan)
+    rhb_x = np.full(n, np.nan)
+    stage = np.full(n, np.nan)
+    left, right = thalweg_banks(x, y, offsets)
+    valid = right - left >= 2
+    if not valid.any():
+        return lhb_x, rhb_x, stage
+    # The channel of each profile, from bank point to bank point
+    lengths = np.where(valid, right - left + 1, 0)
+    sub_offsets = np.concatenate([[0], np.cumsum(lengths)])
+    profile = np.repeat(np.arange(n), lengths)
+    index = np.arange(sub_offsets[-1])
+    cx = x[left[profile] + index - sub_offsets[:-1][profile]]
+    cy = y[left[profile] + index - sub_offsets[:-1][profile]]
+    thalweg = np.zeros(n, dtype = np.int64)
+    thalweg[valid] = np.lexsort((cy, profile))[sub_offsets[:-1][valid]]
+    lowest = np.where(valid, cy[thalweg], np.nan)
+    top = np.where(valid, np.minimum(y[left], y[right]), np.nan)
+    valid &= top > lowest
+    if not valid.any():
+        return lhb_x, rhb_x, stage
+    stages = lowest[:, None] + (top - lowest)[:, None] * np.linspace(0, 1, n_stages)[None, :]
+    curves = lp.rating_curves(cx, cy, np.where(valid[:, None], stages, 0.0), sub_offsets)
+    level = stages[np.arange(n), BANK_CRITERIA[criterion](stages, curves)]
+    # Last point at or above the water left of the thalweg and first one right of it
+    above = cy >= level[profile]
+    last_left = np.full(n, -1, dtype = np.int64)
+    first_right = np.full(n, len(cy), dtype = np.int64)
+    is_left = above & (index < thalweg[profile])
+    is_right = above & (index > thalweg[profile])
+    np.maximum.at(last_left, profile[is_left], index[is_left])
+    np.minimum.at(first_right, profile[is_right], index[is_right])
+    valid &= (last_left >= 0) & (first_right < len(cy))
+    i, j, h = last_left[valid], first_right[valid], level[valid]
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        lhb_x[valid] = np.where(cy[i] > cy[i + 1], cx[i] + (cy[i] - h) / (cy[i] - cy[i + 1]) * (cx[i + 1] - cx[i]),
+                                cx[i + 1])
+        rhb_x[valid] = np.where(cy[j] > cy[j - 1], cx[j] - (cy[j] - h) / (cy[j] - cy[j - 1]) * (cx[j] - cx[j - 1]),
+                                cx[j - 1])
+    stage[valid] = h
+    return lhb_x, rhb_x, stage
+
+
+def detected_banks(criterion):
+    """A BANK_RULES rule that uses detect_banks with the given criterion"""
+    def rule(geometry):
+        lhb, rhb, stage = detect_banks(geometry.x, geometry.y, [0, len(geometry.x)], criterion)
+        if np.isnan(stage[0]):
+            raise ValueError("No channel found to detect banks in")
+        return lhb[0], rhb[0]
+    return rule
+
+
+BANK_RULES = {"ends": banks_at_ends,
+              "thalweg": banks_at_thalweg_maxima,
+              **{name: detected_banks(name) for name in BANK_CRITERIA}}
+
+
+def job_banks(job, criterion = "wd_ratio", n_stages = 100, x_col = "cum_distance", y_col = "elevation"):
+    """Detects the banks of every station in a Job without the GUI.
+
+    Returns a DataFrame with a row per station: lhb_x, lhb_y, rhb_x, rhb_y
+    and the bankfull stage (the bank elevations).
+    """
+    if not all(job.data_dict[t].processed for t in job.station_list):
+        job.process_all()
+    offsets, columns = job.arrays([x_col, y_col])
+    x = np.asarray(columns[x_col], dtype = float)
+    y = np.asarray(columns[y_col], dtype = float)
+    # Sort each profile by chainage, dropping points without coordinates
+    profile = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    keep = np.isfinite(x) & np.isfinite(y)
+    order = np.lexsort((x[keep], profile[keep]))
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(profile[keep], minlength = len(offsets) - 1))])
+    lhb, rhb, stage = detect_banks(x[keep][order], y[keep][order], offsets, criterion, n_stages)
+    return pd.DataFrame({"station": list(job.station_list),
+                         "lhb_x": lhb,
+                         "lhb_y": stage,
+                         "rhb_x": rhb,
+                         "rhb_y": stage,
+                         "stage": stage})
+
+
+def analyse_profile(x, y, lhb = None, rhb = None, banks = "thalweg", mannings = None, slope = None):
+    """Computes every channel metric for one profile.
+
+    lhb and rhb are bank chainages; if either is missing both are chosen by
+    the named rule in BANK_RULES. Velocity and discharge are only included
+    when Manning's n and the bed slope are given. Returns a dict.
+    """
+    geometry = ChannelGeometry(x, y)
+    if lhb is None or rhb is None or np.isnan(lhb) or np.isnan(rhb):
+        lhb, rhb = BANK_RULES[banks](geometry)
+    lhb_y, rhb_y = geometry.bed(lhb), geometry.bed(rhb)
+    metrics = geometry.bank_metrics(lhb, lhb_y, rhb, rhb_y)
+    flow = geometry.hydraulics(lhb, rhb)
+    result = {"lhb_x": lhb,
+              "lhb_y": lhb_y,
+              "rhb_x": rhb,
+              "rhb_y": rhb_y,
+              "width": metrics["width"],
+              "depth": metrics["depth"],
+              "wd_ratio": metrics["wd_ratio"],
+              "channel_area": metrics["area"],
+              "stage": flow["stage"],
+              "flow_area": flow["area"],
+              "wetted_perimeter": flow["wetted_perimeter"],
+              "hydraulic_radius": flow["hydraulic_radius"],
+              "top_width": flow["top_width"],
+              "max_depth": flow["max_depth"]}
+    if mannings is not None and slope is not None:
+        result["velocity"] = float(lp.manning_velocity(flow["hydraulic_radius"], slope, mannings))
+        result["discharge"] = result["velocity"] * flow["area"]
+    return result
+
+
+def load_profiles(path, x_col = "cum_distance", y_col = "elevation"):
+    """Yields (station, x, y) for every profile in a file.
+
+    .csv files hold a single profile (named after the file), .npz files are
+    job archives and anything else is read as a TCR-705 job file. Jobs are
+    processed first if needed.
+    """
+    if path.lower().endswith(".csv"):
+        df = pd.read_csv(path, usecols = [x_col, y_col]).dropna()
+        yield os.path.splitext(os.path.basename(path))[0], df[x_col].to_numpy(), df[y_col].to_numpy()
+        return
+    job = lp.Job.load(path, quiet = True) if path.lower().endswith(".npz") else lp.Job(path, quiet = True)
+    if not all(job.data_dict[t].processed for t in job.station_list):
+        job.process_all()
+    for station_id in job.station_list:
+        df = job.data_dict[station_id].df[[x_col, y_col]].dropna()
+        yield station_id, df[x_col].to_numpy(), df[y_col].to_numpy()
+
+
+def analyse_file(path, bank_table = None, x_col = "cum_distance", y_col = "elevation", n_stages = 100, **kwargs):
+    """Analyses every profile in a file and returns a list of result dicts.
+
+    bank_table maps station IDs to (lhb, rhb) chainages, with the key None
+    applying to every station in the file. With a detection rule (one of
+    BANK_CRITERIA) the banks of every profile in the file are detected in
+    one pass of n_stages water levels. Other keyword arguments are passed
+    to analyse_profile.
+    """
+    bank_table = bank_table or {}
+    profiles = list(load_profiles(path, x_col, y_col))
+    banks = [bank_table.get(station_id, bank_table.get(None, (None, None))) for station_id, x, y in profiles]
+    if kwargs.get("banks") in BANK_CRITERIA and profiles:
+        order = [np.argsort(x, kind = "stable") for station_id, x, y in profiles]
+        offsets = np.concatenate([[0], np.cumsum([len(o) for o in order])])
+        lhb, rhb, stage = detect_banks(np.concatenate([x[o] for (station_id, x, y), o in zip(profiles, order)]),
+                                       np.concatenate([y[o] for (station_id, x, y), o in zip(profiles, order)]),
+                                       offsets, kwargs["banks"], n_stages)
+        banks = [(l, r) if not (l is None or r is None or pd.isna(l) or pd.isna(r)) else (lhb[i], rhb[i])
+                 for i, (l, r) in enumerate(banks)]
+    results = []
+    for (station_id, x, y), (lhb, rhb) in zip(profiles, banks):
+        try:
+            result = analyse_profile(x, y, lhb, rhb, **kwargs)
+            result["error"] = ""
+        except (ValueError, IndexError) as e:
+            result = {"error": str(e)}
+        results.append({"path": path, "station": station_id, **result})
+    return results
+
+
+def read_manifest(fpath):
+    """Reads a manifest CSV into {path: {station or None: (lhb, rhb)}}"""
+    manifest = pd.read_csv(fpath, dtype = {"station": str})
+    tasks = {}
+    for row in manifest.to_dict("records"):
+        station = row.get("station")
+        station = None if pd.isna(station) else str(station)
+        tasks.setdefault(row["path"], {})[station] = (row.get("lhb"), row.get("rhb"))
+    return tasks
+
+
+def analyse_all(tasks, workers = None, **kwargs):
+    """Analyses {path: bank_table} tasks, over a process pool if workers > 1.
+
+    Returns one DataFrame with a row per profile, in task order.
+    """
+    paths = list(tasks)
+    if workers is not None and workers > 1 and len(paths) > 1:
+        with lp.make_pool(workers) as pool:
+            futures = [pool.submit(analyse_file, path, tasks[path], **kwargs) for path in paths]
+            results = [f.result() for f in futures]
+    else:
+        results = [analyse_file(path, tasks[path], **kwargs) for path in paths]
+    return pd.DataFrame([row for rows in results for row in rows])
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Headless cross-section analysis")
+    parser.add_argument("inputs", nargs = "*", 
+                        help = "profile CSV files, TCR-705 job files or .npz job archives")
+    parser.add_argument("--manifest", help = "CSV with path and optional station, lhb and rhb columns")
+    parser.add_argument("-o", "--output", default = "xsec_results.csv", help = "results table (CSV)")
+    parser.add_argument("--workers", type = int, default = os.cpu_count(), help = "number of processes")
+    parser.add_argument("--banks", choices = sorted(BANK_RULES), default = "thalweg",
+                        help = "rule for profiles without bank positions")
+    parser.add_argument("--stages", type = int, default = 100,
+                        help = "water levels scanned per profile by the wd_ratio and curvature rules")
+    parser.add_argument("--x-col", default = "cum_distance", help = "chainage column in CSV inputs")
+    parser.add_argument("--y-col", default = "elevation", help = "elevation column in CSV inputs")
+    parser.add_argument("--mannings", type = float, help = "Manning's n value")
+    parser.add_argument("--slope", type = float, help = "channel bed slope")
+    args = parser.parse_args(argv)
+    tasks = read_manifest(args.manifest) if args.manifest else {}
+    for path in args.inputs:
+        tasks.setdefault(path, {})
+    if not tasks:
+        parser.error("no inputs given")
+    results = analyse_all(tasks, workers = args.workers, banks = args.banks, x_col = args.x_col, 
+                          y_col = args.y_col, n_stages = args.stages, mannings = args.mannings, 
+                          slope = args.slope)
+    results.to_csv(args.output, index = False)
+    print("Wrote {} profiles from {} files to '{}'".format(len(results), len(tasks), args.output))
+
+
+if __name__ == "__main__":
+    main()
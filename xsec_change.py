@@ -0,0 +1,183 @@
+"""
+==============================================================================
+xsec_change v0.1.0
+------------------------------------------------------------------------------
+Cross-section change between repeat surveys of the same transects.
+
+Each epoch is a TCR-705 job file or .npz job archive, given oldest first.
+Stations are matched by station ID and each epoch is compared with the
+previous one (or with the first, with --reference first). Both profiles of
+a station are interpolated onto a common chainage grid over the stretch
+both surveys cover, and every station of an epoch pair is handled in one
+vectorised pass. The results table has one row per station and pair:
+elevation change, net, erosion and deposition area, and the movement of
+the banks (the highest points either side of the thalweg).
+
+Command line:
+    python xsec_change.py 2023.txt 2024.txt 2025.npz -o change.csv --spacing 0.25
+==============================================================================
+"""
+import argparse
+import os
+import numpy as np
+import lts_processor as lp
+import xsec_analysis as xa
+
+pd = lp.LazyModule("pandas")
+
+
+class Epoch:
+    """The profiles of one survey, back to back, and their bank positions.
+
+    job is a Job or the path of a job file or archive. Only the chainage
+    and elevation arrays are kept, so many epochs can be held at once.
+    """
+    def __init__(self, job, label = None, x_col = "cum_distance", y_col = "elevation"):
+        if isinstance(job, str):
+            job = lp.Job.load(job, quiet = True) if job.lower().endswith(".npz") \
+                else lp.Job(job, columnar = True, quiet = True)
+        self.label = label or job.fname
+        self.station_ids = list(job.station_list)
+        self.index = {t: i for i, t in enumerate(self.station_ids)}
+        offsets, columns = job.arrays([x_col, y_col])
+        x = np.asarray(columns[x_col], dtype = float)
+        y = np.asarray(columns[y_col], dtype = float)
+        # Drop points without coordinates and sort each profile by chainage
+        profile = np.repeat(np.arange(len(self.station_ids)), np.diff(offsets))
+        keep = np.isfinite(x) & np.isfinite(y)
+        order = np.lexsort((x[keep], profile[keep]))
+        self.x = x[keep][order]
+        self.y = y[keep][order]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(profile[keep],
+                                                                  minlength = len(self.station_ids)))])
+        left, right = xa.thalweg_banks(self.x, self.y, self.offsets)
+        self.lhb_x = np.where(left >= 0, self.x[left], np.nan)
+        self.rhb_x = np.where(right >= 0, self.x[right], np.nan)
+
+
+    def subset(self, indices):
+        """Returns (x, y, offsets) of the profiles at the given indices"""
+        lengths = np.diff(self.offsets)[indices]
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        positions = np.repeat(self.offsets[:-1][indices] - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return self.x[positions], self.y[positions], offsets
+
+
+def positive_area(d1, d2, dx):
+    """Area above zero of a straight line from d1 to d2 over a width dx"""
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        crossing = np.maximum(d1, d2) ** 2 / np.abs(d1 - d2) * dx / 2
+    return np.where((d1 >= 0) & (d2 >= 0), (d1 + d2) * dx / 2,
+                    np.where((d1 > 0) | (d2 > 0), crossing, 0.0))
+
+
+def compare(before, after, spacing = 0.5):
+    """Change from one Epoch to another for every station surveyed in both.
+
+    Returns a DataFrame with a row per station.
+    """
+    common = [t for t in after.station_ids if t in before.index]
+    n = len(common)
+    x_a, y_a, off_a = before.subset(np.array([before.index[t] for t in common], dtype = np.int64))
+    x_b, y_b, off_b = after.subset(np.array([after.index[t] for t in common], dtype = np.int64))
+    # Common grid over the stretch both surveys cover
+    starts = np.full(n, np.nan)
+    ends = np.full(n, np.nan)
+    both = (np.diff(off_a) > 0) & (np.diff(off_b) > 0)
+    starts[both] = np.maximum(x_a[off_a[:-1][both]], x_b[off_b[:-1][both]])
+    ends[both] = np.minimum(x_a[off_a[1:][both] - 1], x_b[off_b[1:][both] - 1])
+    starts[starts > ends] = np.nan
+    ends[np.isnan(starts)] = np.nan
+    # Resampling a two-point "profile" of each overlap gives a grid that keeps both its ends
+    valid = np.isfinite(starts)
+    grid, _, grid_offsets, _ = lp.resample_transects(np.column_stack([starts, ends])[valid].ravel(), {},
+                                                     np.concatenate([[0], np.cumsum(np.where(valid, 2, 0))]),
+                                                     spacing = spacing)
+    dz = lp.interpolate_transects(x_b, {"y": y_b}, off_b, grid, grid_offsets)["y"] \
+        - lp.interpolate_transects(x_a, {"y": y_a}, off_a, grid, grid_offsets)["y"]
+    counts = np.diff(grid_offsets)
+    station = np.repeat(np.arange(n), counts)
+    has_grid = counts > 0
+    min_dz = np.full(n, np.nan)
+    max_dz = np.full(n, np.nan)
+    if has_grid.any():
+        min_dz[has_grid] = np.minimum.reduceat(dz, grid_offsets[:-1][has_grid])
+        max_dz[has_grid] = np.maximum.reduceat(dz, grid_offsets[:-1][has_grid])
+    # Trapezoids between neighbouring grid points of the same station
+    same = station[1:] == station[:-1]
+    d1, d2, dx = dz[:-1][same], dz[1:][same], np.diff(grid)[same]
+    deposition = np.bincount(station[:-1][same], positive_area(d1, d2, dx), minlength = n)
+    erosion = np.bincount(station[:-1][same], positive_area(-d1, -d2, dx), minlength = n)
+    ia = np.array([before.index[t] for t in common], dtype = np.int64)
+    ib = np.array([after.index[t] for t in common], dtype = np.int64)
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        mean_dz = np.bincount(station, dz, minlength = n) / counts
+    return pd.DataFrame({"station": common,
+                         "before": before.label,
+                         "after": after.label,
+                         "grid_start": starts,
+                         "grid_end": ends,
+                         "n_points": counts,
+                         "mean_dz": mean_dz,
+                         "min_dz": min_dz,
+                         "max_dz": max_dz,
+                         "net_area_change": np.where(has_grid, deposition - erosion, np.nan),
+                         "erosion_area": np.where(has_grid, erosion, np.nan),
+                         "deposition_area": np.where(has_grid, deposition, np.nan),
+                         "lhb_x_before": before.lhb_x[ia],
+                         "lhb_x_after": after.lhb_x[ib],
+                         "lhb_shift": after.lhb_x[ib] - before.lhb_x[ia],
+                         "rhb_x_before": before.rhb_x[ia],
+                         "rhb_x_after": after.rhb_x[ib],
+                         "rhb_shift": after.rhb_x[ib] - before.rhb_x[ia],
+                         "width_change": (after.rhb_x[ib] - after.lhb_x[ib]) - (before.rhb_x[ia] - before.lhb_x[ia])})
+
+
+def compare_epochs(epochs, spacing = 0.5, reference = "previous"):
+    """Compares a list of Epochs, oldest first, and returns one results table.
+
+    With reference="previous" each epoch is compared with the one before
+    it, with reference="first" every epoch is compared with the first.
+    """
+    if reference not in ("previous", "first"):
+        raise ValueError(f"Unknown reference '{reference}' (expected 'previous' or 'first')")
+    pairs = [(epochs[0 if reference == "first" else i - 1], epochs[i]) for i in range(1, len(epochs))]
+    return pd.concat([compare(before, after, spacing) for before, after in pairs], ignore_index = True)
+
+
+def load_epochs(paths, labels = None, workers = None, x_col = "cum_distance", y_col = "elevation"):
+    """Builds an Epoch per path, over a process pool if workers > 1"""
+    labels = labels or [os.path.basename(path) for path in paths]
+    args = (paths, labels, [x_col] * len(paths), [y_col] * len(paths))
+    if workers is not None and workers > 1 and len(paths) > 1:
+        with lp.make_pool(workers) as pool:
+            return list(pool.map(Epoch, *args))
+    return list(map(Epoch, *args))
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Cross-section change between repeat surveys")
+    parser.add_argument("epochs", nargs = "+", help = "TCR-705 job files or .npz job archives, oldest first")
+    parser.add_argument("--labels", nargs = "+", help = "names for the epochs (default: file names)")
+    parser.add_argument("-o", "--output", default = "xsec_change.csv", help = "results table (CSV)")
+    parser.add_argument("--spacing", type = float, default = 0.5, help = "common grid spacing (m)")
+    parser.add_argument("--reference", choices = ["previous", "first"], default = "previous",
+                        help = "compare each epoch with the previous one or with the first")
+    parser.add_argument("--workers", type = int, default = os.cpu_count(),
+                        help = "number of processes for loading epochs")
+    parser.add_argument("--x-col", default = "cum_distance", help = "chainage column")
+    parser.add_argument("--y-col", default = "elevation",
+                        help = "elevation column (e.g. corrected_elevation in archives)")
+    args = parser.parse_args(argv)
+    if len(args.epochs) < 2:
+        parser.error("at least two epochs are needed")
+    if args.labels and len(args.labels) != len(args.epochs):
+        parser.error("give one label per epoch")
+    epochs = load_epochs(args.epochs, args.labels, args.workers, args.x_col, args.y_col)
+    results = compare_epochs(epochs, args.spacing, args.reference)
+    results.to_csv(args.output, index = False)
+    print("Wrote {} station comparisons from {} epochs to '{}'".format(len(results), len(epochs), args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,172 @@
 import tkinter as tk
 import os
-from tkinter import filedialog
-import pandas as pd
+import queue
+import threading
+from collections import OrderedDict
 import numpy as np
 import lts_processor as lp
+from xsec_analysis import SortedLookup, ChannelGeometry, poly_area, BANK_RULES, BANK_CRITERIA, detect_banks
+from xsec_change import Epoch
+
+# Dialogs and pandas are only needed once a file is opened
+filedialog = lp.LazyModule("tkinter.filedialog")
+simpledialog = lp.LazyModule("tkinter.simpledialog")
+pd = lp.LazyModule("pandas")
  
 
+def decimate_minmax(x, y):
+    """Reduces a polyline to at most four points per pixel column.
+
+    Consecutive points that fall in the same integer x pixel are replaced by
+    the first, lowest, highest and last of them, which draws the same shape
+    at that resolution. Returns the indices of the kept points in their
+    original order.
+    """
+    x = np.asarray(x, dtype = float)
+    y = np.asarray(y, dtype = float)
+    if len(x) == 0:
+        return np.arange(0)
+    column = np.floor(x).astype(np.int64)
+    starts = np.flatnonzero(np.concatenate([[True], column[1:] != column[:-1]]))
+    ends = np.append(starts[1:], len(x)) - 1
+    run = np.repeat(np.arange(len(starts)), ends - starts + 1)
+    # Sorting by (run, y) puts each run's lowest point at its start and highest at its end
+    order = np.lexsort((y, run))
+    return np.unique(np.concatenate([starts, ends, order[starts], order[ends]]))
+
+
+def read_columns(fpath, columns, chunksize = 100000, progress = None):
+    """Reads only the given columns of a CSV file, chunksize rows at a time.
+
+    progress, if given, is called with the fraction of the file read so far
+    after every chunk. Returns a DataFrame.
+    """
+    size = max(os.path.getsize(fpath), 1)
+    chunks = []
+    with open(fpath, "rb") as file:
+        for chunk in pd.read_csv(file, usecols = columns, chunksize = chunksize):
+            chunks.append(chunk)
+            if progress is not None:
+                progress(min(file.tell() / size, 1.0))
+    if not chunks:
+        return pd.read_csv(fpath, usecols = columns)
+    return pd.concat(chunks, ignore_index = True)
+
+
+class JobSession:
+    """Every station of a job held in memory for review in the App.
+
+    job is a Job or the path of a job file or .npz archive. The profiles
+    are kept back to back (see xsec_change.Epoch), with their canvas
+    coordinates for a width x height plot computed for all stations at
+    once. Banks start from detect_banks with the given rule ("none" leaves
+    them unset) and are updated as they are picked; banks holds lhb_x,
+    lhb_y, rhb_x and rhb_y per station. Lookups and geometry for a station
+    are built the first time it is shown.
+    """
+    def __init__(self, job, rule = "wd_ratio", width = 1000, height = 600, 
+                 x_col = "cum_distance", y_col = "elevation"):
+        self.fpath = job if isinstance(job, str) else job.fpath
+        profiles = Epoch(job, x_col = x_col, y_col = y_col)
+        self.name = profiles.label
+        self.x_col, self.y_col = x_col, y_col
+        self.station_ids = profiles.station_ids
+        self.x, self.y, self.offsets = profiles.x, profiles.y, profiles.offsets
+        n = len(self.station_ids)
+        lengths = np.diff(self.offsets)
+        has_points = lengths > 0
+        bounds = np.full((4, n), np.nan)
+        if has_points.any():
+            starts = self.offsets[:-1][has_points]
+            bounds[:, has_points] = [np.minimum.reduceat(self.x, starts), np.maximum.reduceat(self.x, starts),
+                                     np.minimum.reduceat(self.y, starts), np.maximum.reduceat(self.y, starts)]
+        x_min, x_max, y_min, y_max = bounds[:, np.repeat(np.arange(n), lengths)]
+        # Same transforms as App.load_data, for every point at once
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            self.x_map = (self.x - x_min) * (width / (x_max - x_min)) + 1
+            self.y_map = (y_max - self.y) * (height / (y_max - y_min)) + 2
+        self.banks = np.full((n, 4), np.nan)
+        if rule in BANK_CRITERIA:
+            lhb, rhb, stage = detect_banks(self.x, self.y, self.offsets, rule)
+            self.banks[:] = np.column_stack([lhb, stage, rhb, stage])
+        self._lookups = {}
+
+    def __len__(self):
+        return len(self.station_ids)
+
+    def profile(self, i):
+        """Returns (x, y, x_map, y_map) of station i"""
+        part = slice(self.offsets[i], self.offsets[i+1])
+        return self.x[part], self.y[part], self.x_map[part], self.y_map[part]
+
+    def lookups(self, i):
+        """Returns (x_lookup, y_lookup, geometry) of station i"""
+        if i not in self._lookups:
+            x, y = self.profile(i)[:2]
+            self._lookups[i] = (SortedLookup(x, y), SortedLookup(y, x), ChannelGeometry(x, y))
+        return self._lookups[i]
+
+    def set_bank(self, i, bank, x, y):
+        """Records the left (bank 0) or right (bank 1) bank of station i"""
+        self.banks[i, 2*bank:2*bank+2] = x, y
+
+    def banks_frame(self):
+        """Bank picks as a manifest for xsec_analysis (path, station, lhb, rhb)"""
+        return pd.DataFrame({"path": self.fpath,
+                             "station": self.station_ids,
+                             "lhb": self.banks[:, 0],
+                             "rhb": self.banks[:, 2],
+                             "lhb_y": self.banks[:, 1],
+                             "rhb_y": self.banks[:, 3]})
+
+
 class App(tk.Tk):
+    # Survey point markers are only drawn when points are at least this many
+    # pixels apart on average
+    MARKER_SPACING = 2
+    # How often (ms) the Tk loop checks on a background load
+    POLL_INTERVAL = 50
+    # Rendered station canvases kept for instant switching in a job session
+    CANVAS_CACHE = 20
+    CANVAS_ITEMS = ("canvaspolygon_CHANNEL", "canvasline_VTCROSSHAIR", "canvasline_HZCROSSHAIR", "canvasline_LHB",
+                    "canvasline_RHB", "canvaslabel_LHB", "canvaslabel_RHB")
+
     def __init__(self): 
         super().__init__()
         self.geometry("1500x768")
         self.title("Cross-section analyser v0.0")
-        self.iconphoto(False, tk.PhotoImage(file='C:/Users/Carl/Desktop/window_icon.bmp'))
+        try:
+            self.iconphoto(False, tk.PhotoImage(file=os.path.join(os.path.dirname(os.path.abspath(__file__)), 
+                                                                  'window_icon.bmp')))
+        except tk.TclError:
+            pass
         
         
         # Menubar
         self.menubar = tk.Menu(self)
         self.filemenu = tk.Menu(self.menubar, tearoff=0)
         self.filemenu.add_command(label="Open comma-separated values (CSV)", command=self.open_file)
-        self.filemenu.add_command(label="Open total station output file", command=self.open_file)
+        self.filemenu.add_command(label="Open total station output file", command=self.open_job)
+        self.filemenu.add_command(label="Save bank picks...", command=self.save_banks)
         self.menubar.add_cascade(label="File", menu=self.filemenu)
         self.helpmenu = tk.Menu(self.menubar, tearoff=0)
         self.helpmenu.add_command(label="About...", command=self.donothing)
         self.menubar.add_cascade(label="Help", menu=self.helpmenu)
         self.config(menu=self.menubar)
         self.configure(bg='darkgrey')
+        self.channel_geometry = None
+        self._idle_jobs = {}
+        self._pointer = (500, 300)
+        self.df = None
+        self.fpath = None
+        self.session = None
+        self.station_index = None
+        self._canvases = OrderedDict()
+        self._canvas_items = {}
+        self._worker_queue = queue.Queue()
+        self._worker_id = 0
+        self._workers = {}
+        self._polling = False
         
         
         # tkvars
@@ -45,21 +187,20 @@ class App(tk.Tk):
                         "tkv_CANVAS_xytag": tk.StringVar(),
                         "tkv_SNAP": tk.BooleanVar(False),
                         "tkv_SELECTEDBANK": tk.IntVar(),
+                        "tkv_AUTOBANKS": tk.StringVar(value="wd_ratio"),
                         "tkv_UNITSTREAMPOWER": tk.DoubleVar(),
                         "tkv_XVALSVARNAME": tk.StringVar(),
                         "tkv_YVALSVARNAME": tk.StringVar(),
                         "tkv_FILENAME": tk.StringVar(value="None"),
+                        "tkv_STATUS": tk.StringVar(value=""),
                         "tkv_JOB": tk.StringVar(value="None"),
-                        "tkv_NSTATIONS": tk.StringVar(value="None")}
+                        "tkv_NSTATIONS": tk.StringVar(value="None"),
+                        "tkv_STATION": tk.StringVar(value="None")}
         
         
         # Canvas
-        self.canvas_PLOT = tk.Canvas(self, 
-                                     bg="lightgray", 
-                                     height = 600, 
-                                     width = 1000,
-                                     cursor = "none",
-                                     background = 'black')
+        self.canvas_PLOT = self.make_canvas()
+        self._main_canvas = self.canvas_PLOT
         self.canvas_PLOT.grid(column=1, row=0, rowspan=2)
         self.canvas_PLOT.grid_propagate(False)
         
@@ -96,6 +237,10 @@ class App(tk.Tk):
                                                   text = "Estimate discharge...",
                                                   command = self.press_discharge_button,
                                                   bg="darkgrey").grid(row = 9, column = 0, sticky='w')
+        self.button_RATINGCURVE = tk.Button(master = self.labelframe_CHANNELMETRICS, 
+                                            text = "Rating curve...",
+                                            command = self.show_rating_curve,
+                                            bg="darkgrey").grid(row = 10, column = 0, sticky='w')
         self.label_FLOWVELOCITY = tk.Label(master = self.labelframe_CHANNELMETRICS, 
                                            text = "Flow velocity (u/sec): ",
                                            bg="darkgrey").grid(row = 6, column = 0, sticky = 'w')
@@ -104,10 +249,10 @@ class App(tk.Tk):
                                         bg="darkgrey").grid(row = 7, column = 0, sticky = 'w')
         self.entry_SLOPE = tk.Entry(master = self.labelframe_CHANNELMETRICS, 
                                     width=6)
-        self.entry_SLOPE.grid(row = 4, column = 1, sticky = 'w')
+        self.entry_SLOPE.grid(row = 5, column = 1, sticky = 'w')
         self.entry_MANNINGS = tk.Entry(master = self.labelframe_CHANNELMETRICS, 
                                        width=6)
-        self.entry_MANNINGS.grid(row = 5, column = 1, sticky = 'w')
+        self.entry_MANNINGS.grid(row = 4, column = 1, sticky = 'w')
         # Column 1: values
         self.label_CHANNELWIDTH_VAL = tk.Label(master = self.labelframe_CHANNELMETRICS,
                                                textvariable = self.tk_vars["tkv_CHANNELWIDTH"],
@@ -192,8 +337,26 @@ class App(tk.Tk):
                                                bg="darkgrey").grid(column=1,row=3, sticky="w",columnspan=2)
         self.button_PLOT = tk.Button(master = self.labelframe_CANVASOPTIONS, 
                                      text = "Plot...",
-                                     command = self.plot,
+                                     command = lambda: self.schedule_idle("plot", self.plot),
                                      bg="darkgrey").grid(row = 6, column = 0, sticky='w')
+        self.label_STATUS = tk.Label(master = self.labelframe_CANVASOPTIONS,
+                                     textvariable = self.tk_vars["tkv_STATUS"],
+                                     anchor = 'w',
+                                     bg="darkgrey").grid(row = 6, column = 1, columnspan = 2, sticky = 'w')
+        # Banks are detected when a profile is plotted; clicking still moves them
+        self.label_AUTOBANKS = tk.Label(master = self.labelframe_CANVASOPTIONS,
+                                        text = "Auto banks: ",
+                                        anchor = 'w',
+                                        bg="darkgrey").grid(row = 7, column = 0, sticky = 'w')
+        self.optionmenu_AUTOBANKS = tk.OptionMenu(self.labelframe_CANVASOPTIONS,
+                                                  self.tk_vars["tkv_AUTOBANKS"],
+                                                  "none", *BANK_CRITERIA)
+        self.optionmenu_AUTOBANKS.configure(bg="darkgrey")
+        self.optionmenu_AUTOBANKS.grid(row=7, column=1, columnspan=2, sticky='w')
+        self.button_DETECTBANKS = tk.Button(master = self.labelframe_CANVASOPTIONS, 
+                                            text = "Detect banks",
+                                            command = self.detect_banks,
+                                            bg="darkgrey").grid(row = 8, column = 0, sticky='w')
         self.canvaspolygon_CHANNEL = self.canvas_PLOT.create_polygon(1, 1, 1, 1, 1, 1, fill="blue")                                                                                        
         self.canvasline_VTCROSSHAIR = self.canvas_PLOT.create_line(500, 0, 500, 600, fill = 'gray')
         self.canvasline_HZCROSSHAIR = self.canvas_PLOT.create_line(0, 300, 1000, 300, fill = 'gray')
@@ -224,43 +387,114 @@ class App(tk.Tk):
         self.labelframe_TSJOB = tk.LabelFrame(self, text = "Total station job", width=40, bg="darkgrey")
         self.label_JOB = tk.Label(master = self.labelframe_TSJOB, text = "Job: ", bg="darkgrey").grid(row=0, column=0, sticky = "w")
         self.label_NSTATIONS = tk.Label(master = self.labelframe_TSJOB, text = "Stations: ", bg="darkgrey").grid(row=1, column=0, sticky = "w")
-        self.label_NSTATIONS_VAL = tk.Label(master = self.labelframe_CHANNELMETRICS,
+        self.label_STATION = tk.Label(master = self.labelframe_TSJOB, text = "Station: ", bg="darkgrey").grid(row=2, column=0, sticky = "w")
+        self.label_NSTATIONS_VAL = tk.Label(master = self.labelframe_TSJOB,
                                       textvariable = self.tk_vars["tkv_NSTATIONS"],
                                       anchor = "w",
                                       bg="darkgrey").grid(row = 1, column=1, sticky = 'w')
-        self.label_JOB_VAL = tk.Label(master = self.labelframe_CHANNELMETRICS,
+        self.label_JOB_VAL = tk.Label(master = self.labelframe_TSJOB,
                                       textvariable = self.tk_vars["tkv_JOB"],
                                       anchor = "w",
                                       bg="darkgrey").grid(row = 0, column=1, sticky = 'w')
+        self.label_STATION_VAL = tk.Label(master = self.labelframe_TSJOB,
+                                          textvariable = self.tk_vars["tkv_STATION"],
+                                          anchor = "w",
+                                          bg="darkgrey").grid(row = 2, column=1, sticky = 'w')
+        # Station list of a job session; Up/Down and Page Up/Down switch stations
+        self.listbox_STATIONS = tk.Listbox(self.labelframe_TSJOB, height = 12, width = 24, exportselection = False)
+        self.scrollbar_STATIONS = tk.Scrollbar(self.labelframe_TSJOB, command = self.listbox_STATIONS.yview)
+        self.listbox_STATIONS.configure(yscrollcommand = self.scrollbar_STATIONS.set)
+        self.listbox_STATIONS.grid(row = 3, column = 0, columnspan = 2, sticky = "w")
+        self.scrollbar_STATIONS.grid(row = 3, column = 2, sticky = "ns")
+        self.listbox_STATIONS.bind("<<ListboxSelect>>", self.select_station)
+        for key, step in (("<Down>", 1), ("<Up>", -1), ("<Next>", 10), ("<Prior>", -10)):
+            self.bind(key, lambda event, step = step: self.step_station(step))
+            self.listbox_STATIONS.bind(key, lambda event, step = step: self.step_station(step))
         self.labelframe_TSJOB.grid(row = 1, column=0, sticky="sw", padx = 10, pady = 0)
         
 
+    def flow_inputs(self):
+        """Returns (Manning's n, slope) from the entries, or None after reporting why not"""
+        if self.channel_geometry is None:
+            self.tk_vars["tkv_STATUS"].set("Load a profile first")
+            return None
+        try:
+            mannings = float(self.entry_MANNINGS.get())
+            slope = float(self.entry_SLOPE.get())
+        except ValueError:
+            self.tk_vars["tkv_STATUS"].set("Manning's n and slope must be numbers")
+            return None
+        self.tk_vars["tkv_STATUS"].set("")
+        return mannings, slope
+
+
     def press_discharge_button(self):
         """Calculates the discharge and flow velocity once the button is pressed"""
-
-        self.tk_vars["tkv_MANNINGS"].set(self.entry_MANNINGS.get())
-        self.tk_vars["tkv_SLOPE"].set(self.entry_SLOPE.get())
-        self.tk_vars["tkv_FLOWVELOCITY"].set(self.calc_flow_velocity(self.tk_vars["tkv_CHANNELDEPTH"].get(),
-                                                self.tk_vars["tkv_SLOPE"].get(), 
-                                                self.tk_vars["tkv_MANNINGS"].get()))
-        self.tk_vars["tkv_DISCHARGE"].set(self.calc_discharge(self.tk_vars["tkv_CHANNELAREA"].get(),
-                                                   self.tk_vars["tkv_FLOWVELOCITY"].get()))
+        inputs = self.flow_inputs()
+        if inputs is None:
+            return
+        self.tk_vars["tkv_MANNINGS"].set(inputs[0])
+        self.tk_vars["tkv_SLOPE"].set(inputs[1])
+        # Bankfull flow at the lower of the two banks
+        flow = self.channel_geometry.hydraulics(self.tk_vars["tkv_LHB_x"].get(), self.tk_vars["tkv_RHB_x"].get())
+        self.tk_vars["tkv_FLOWVELOCITY"].set(round(self.calc_flow_velocity(flow["hydraulic_radius"],
+                                                                           self.tk_vars["tkv_SLOPE"].get(), 
+                                                                           self.tk_vars["tkv_MANNINGS"].get()), 4))
+        self.tk_vars["tkv_DISCHARGE"].set(round(self.calc_discharge(flow["area"],
+                                                                    self.tk_vars["tkv_FLOWVELOCITY"].get()), 4))
 
 
     def calc_discharge(self, area, flow_velocity):
         return area*flow_velocity
     
     
-    def calc_flow_velocity(self, depth, slope, mannings):
-        return depth**(0.66666) * slope**(0.5) / mannings
+    def calc_flow_velocity(self, hydraulic_radius, slope, mannings):
+        return lp.manning_velocity(hydraulic_radius, slope, mannings)
+
+
+    def show_rating_curve(self, n_stages = 50):
+        """Shows the stage-discharge table for the channel between the banks.
 
+        Without a valid bank pair the whole profile is used. Stages run from
+        the lowest point up to the lower bank.
+        """
+        inputs = self.flow_inputs()
+        if inputs is None:
+            return
+        mannings, slope = inputs
+        xl, xr = self.tk_vars["tkv_LHB_x"].get(), self.tk_vars["tkv_RHB_x"].get()
+        if xr <= xl:
+            xl, xr = self.channel_geometry.x[0], self.channel_geometry.x[-1]
+        xs, ys = self.channel_geometry.polygon(xl, self.channel_geometry.bed(xl), xr, self.channel_geometry.bed(xr))
+        stages = np.linspace(ys.min(), min(ys[0], ys[-1]), n_stages)
+        curve = lp.rating_curves(xs, ys, stages)
+        velocity = lp.manning_velocity(curve["hydraulic_radius"][0], slope, mannings)
+        window = tk.Toplevel(self)
+        window.title("Rating curve")
+        text = tk.Text(window, width = 80, height = n_stages + 2)
+        text.insert(tk.END, "{:>10} {:>10} {:>10} {:>10} {:>10} {:>12}\n".format("Stage", "Area", "Width", 
+                                                                                "R", "Velocity", "Discharge"))
+        for row in zip(stages, curve["area"][0], curve["top_width"][0], 
+                       curve["hydraulic_radius"][0], velocity, curve["area"][0] * velocity):
+            text.insert(tk.END, "{:>10.3f} {:>10.3f} {:>10.3f} {:>10.4f} {:>10.4f} {:>12.4f}\n".format(*row))
+        text.configure(state = "disabled")
+        text.pack(fill = "both", expand = True)
 
-    def load_data(self, x_array, y_array):
+
+    def load_data(self, x_array, y_array, x_map = None, y_map = None, lookups = None):
+        """Sets the profile on show; canvas coordinates and lookups can be passed in precomputed"""
         self.x_array = x_array
         self.y_array = y_array
-        self.y_array_flipped = (self.y_array - self.y_array.max()).abs() 
-        self.x_array_map = (self.x_array - self.x_array.min()) * (1000 / (self.x_array.max() - self.x_array.min())) + 1
-        self.y_array_flipped_map = (self.y_array_flipped - self.y_array_flipped.min()) * (600 / (self.y_array_flipped.max() - self.y_array_flipped.min())) + 2
+        self.y_array_flipped = np.abs(self.y_array - self.y_array.max())
+        if x_map is None:
+            x_map = (self.x_array - self.x_array.min()) * (1000 / (self.x_array.max() - self.x_array.min())) + 1
+            y_map = (self.y_array_flipped - self.y_array_flipped.min()) * (600 / (self.y_array_flipped.max() - self.y_array_flipped.min())) + 2
+        self.x_array_map = x_map
+        self.y_array_flipped_map = y_map
+        if lookups is None:
+            lookups = (SortedLookup(self.x_array, self.y_array), SortedLookup(self.y_array, self.x_array),
+                       ChannelGeometry(self.x_array, self.y_array))
+        self.x_lookup, self.y_lookup, self.channel_geometry = lookups
 
 
     def donothing(self):
@@ -277,99 +511,346 @@ class App(tk.Tk):
         return map_x, map_y
 
     def open_file(self):
-        self.fpath = filedialog.askopenfilename(initialdir = os.getcwd(),
-                                                title = "Select file...",
-                                                filetypes = (("CSV files", "*.csv*"),
-                                                             ("All files", "*.*")))
-        self.tk_vars["tkv_FILENAME"].set(self.fpath.split("/")[-1])
-        self.df = pd.read_csv(self.fpath)
-        for var in self.df.columns:
-            self.optionmenu_SELECTXVAR['menu'].add_command(label=var, command=tk._setit(self.tk_vars["tkv_XVALSVARNAME"], var))
-            self.optionmenu_SELECTYVAR['menu'].add_command(label=var, command=tk._setit(self.tk_vars["tkv_YVALSVARNAME"], var))
-
-    def find_nearest(self, v, vals):
-        return min(vals, key=lambda x:abs(x-v))
-
-    def find_surrounding(self, v, li):
-        return max(x for x in li if x < v), min(x for x in li if x > v)
+        """Opens a CSV file or job archive and lists its columns for plotting.
+
+        Only the header of a CSV file is read here (on a worker thread); the
+        chosen X and Y columns are read when the profile is plotted. Job
+        archives are memory-mapped, so only the chosen station is read.
+        """
+        fpath = filedialog.askopenfilename(initialdir = os.getcwd(),
+                                           title = "Select file...",
+                                           filetypes = (("CSV files", "*.csv*"),
+                                                        ("Job archives", "*.npz"),
+                                                        ("All files", "*.*")))
+        if not fpath:
+            return
+        self.close_session()
+        if fpath.endswith(".npz"):
+            job = lp.Job.load(fpath)
+            station_id = simpledialog.askstring("Select station", 
+                                                "Station ID ({} stations):".format(job.n_stations),
+                                                initialvalue = job.station_list[0],
+                                                parent = self)
+            if station_id not in job.data_dict:
+                return
+            self.fpath = fpath
+            self.tk_vars["tkv_FILENAME"].set(fpath.split("/")[-1])
+            self.tk_vars["tkv_JOB"].set(job.fname)
+            self.tk_vars["tkv_NSTATIONS"].set(job.n_stations)
+            self.df = job.data_dict[station_id].df
+            self.set_columns(list(self.df.columns))
+            return
+        self.fpath = fpath
+        self.tk_vars["tkv_FILENAME"].set(fpath.split("/")[-1])
+        self.df = None
+        self.run_in_background(lambda progress: list(pd.read_csv(fpath, nrows = 0).columns),
+                               self.set_columns, "Reading columns")
+
+    def set_columns(self, columns):
+        """Rebuilds both column menus, keeping the selected columns if they exist"""
+        defaults = (("tkv_XVALSVARNAME", "cum_distance", 0), ("tkv_YVALSVARNAME", "elevation", 1))
+        for menu, (var, preferred, position) in zip((self.optionmenu_SELECTXVAR, self.optionmenu_SELECTYVAR), 
+                                                    defaults):
+            menu['menu'].delete(0, "end")
+            for column in columns:
+                menu['menu'].add_command(label=column, command=tk._setit(self.tk_vars[var], column))
+            if self.tk_vars[var].get() not in columns and columns:
+                self.tk_vars[var].set(preferred if preferred in columns else columns[min(position, len(columns) - 1)])
+
+    def make_canvas(self):
+        """A plot canvas with the crosshair and bank-picking bindings"""
+        canvas = tk.Canvas(self, 
+                           bg="lightgray", 
+                           height = 600, 
+                           width = 1000,
+                           cursor = "none",
+                           background = 'black')
+        canvas.bind('<Motion>', self.motion)
+        canvas.bind('<Button-1>', self.click)
+        return canvas
+
+    def show_canvas(self, canvas):
+        """Puts canvas in place of the current plot canvas, swapping its item IDs in"""
+        if canvas is self.canvas_PLOT:
+            return
+        self._canvas_items[str(self.canvas_PLOT)] = {name: self.__dict__[name] for name in self.CANVAS_ITEMS 
+                                                     if name in self.__dict__}
+        self.canvas_PLOT.grid_remove()
+        canvas.grid(column=1, row=0, rowspan=2)
+        canvas.grid_propagate(False)
+        self.canvas_PLOT = canvas
+        for name, item in self._canvas_items.get(str(canvas), {}).items():
+            setattr(self, name, item)
+
+    def open_job(self):
+        """Loads a whole job (TCR-705 file or .npz archive) for station-by-station review"""
+        fpath = filedialog.askopenfilename(initialdir = os.getcwd(),
+                                           title = "Select job...",
+                                           filetypes = (("Total station files", "*.txt"),
+                                                        ("Job archives", "*.npz"),
+                                                        ("All files", "*.*")))
+        if not fpath:
+            return
+        rule = self.tk_vars["tkv_AUTOBANKS"].get()
+        self.run_in_background(lambda progress: JobSession(fpath, rule), self.start_session, "Loading job")
+
+    def start_session(self, session):
+        self.close_session()
+        self.session = session
+        self.fpath = session.fpath
+        self.df = None
+        self.tk_vars["tkv_FILENAME"].set(session.fpath.split("/")[-1])
+        self.tk_vars["tkv_JOB"].set(session.name)
+        self.tk_vars["tkv_NSTATIONS"].set(len(session))
+        self.set_columns([session.x_col, session.y_col])
+        self.listbox_STATIONS.insert(tk.END, *session.station_ids)
+        self.listbox_STATIONS.focus_set()
+        self.show_station(0)
+
+    def close_session(self):
+        """Drops the job session and its canvases, going back to the single-profile canvas"""
+        self.show_canvas(self._main_canvas)
+        for canvas in self._canvases.values():
+            self._canvas_items.pop(str(canvas), None)
+            canvas.destroy()
+        self._canvases.clear()
+        self.listbox_STATIONS.delete(0, tk.END)
+        self.session = None
+        self.station_index = None
+        self.tk_vars["tkv_STATION"].set("None")
+
+    def select_station(self, event):
+        selection = self.listbox_STATIONS.curselection()
+        if selection:
+            self.show_station(selection[0])
+
+    def step_station(self, step):
+        if self.session is not None and self.station_index is not None:
+            self.show_station(min(max(self.station_index + step, 0), len(self.session) - 1))
+        return "break"
+
+    def show_station(self, i, redraw = False):
+        """Shows station i of the session, from the canvas cache if it was rendered recently"""
+        if self.session is None or not 0 <= i < len(self.session):
+            return
+        x, y, x_map, y_map = self.session.profile(i)
+        self.station_index = i
+        self.tk_vars["tkv_STATION"].set("{} ({}/{})".format(self.session.station_ids[i], i + 1, len(self.session)))
+        self.listbox_STATIONS.selection_clear(0, tk.END)
+        self.listbox_STATIONS.selection_set(i)
+        self.listbox_STATIONS.activate(i)
+        self.listbox_STATIONS.see(i)
+        if len(x) < 2:
+            self.tk_vars["tkv_STATUS"].set("Too few points to plot")
+            return
+        self.tk_vars["tkv_STATUS"].set("")
+        canvas = self._canvases.pop(i, None)
+        if canvas is not None and redraw:
+            self._canvas_items.pop(str(canvas), None)
+            canvas.destroy()
+            canvas = None
+        self.load_data(x, y, x_map, y_map, self.session.lookups(i))
+        if canvas is None:
+            canvas = self.make_canvas()
+            self.show_canvas(canvas)
+            self.draw(x_map, y_map)
+        else:
+            self.show_canvas(canvas)
+        self._canvases[i] = canvas
+        while len(self._canvases) > self.CANVAS_CACHE:
+            oldest = self._canvases.popitem(last = False)[1]
+            self._canvas_items.pop(str(oldest), None)
+            oldest.destroy()
+        lhb_x, lhb_y, rhb_x, rhb_y = self.session.banks[i]
+        if np.isfinite([lhb_x, rhb_x]).all():
+            self.place_bank(0, self.transform_data_to_map(lhb_x, 0)[0], lhb_x, lhb_y)
+            self.place_bank(1, self.transform_data_to_map(rhb_x, 0)[0], rhb_x, rhb_y)
+            self.get_channel_coordinates()
+        else:
+            for name in ("tkv_LHB_x", "tkv_LHB_y", "tkv_RHB_x", "tkv_RHB_y", "tkv_CHANNELWIDTH", 
+                         "tkv_CHANNELDEPTH", "tkv_CHANNELWDRATIO", "tkv_CHANNELAREA"):
+                self.tk_vars[name].set(0.0)
+
+    def save_banks(self):
+        """Writes the bank picks of the job session as a manifest CSV for xsec_analysis"""
+        if self.session is None:
+            return
+        fpath = filedialog.asksaveasfilename(initialdir = os.getcwd(),
+                                             title = "Save bank picks...",
+                                             defaultextension = ".csv",
+                                             filetypes = (("CSV files", "*.csv"),))
+        if fpath:
+            self.session.banks_frame().to_csv(fpath, index = False)
+
+    def run_in_background(self, work, on_done, label):
+        """Runs work(progress) on a worker thread and on_done(result) in Tk.
+
+        progress(fraction) may be called from the worker; the status label is
+        updated from the queue by after() callbacks, so Tk is only touched
+        from the main thread. Jobs are told apart by label: starting one makes
+        a running job with the same label stale, and its result is dropped,
+        while jobs with other labels carry on.
+        """
+        self._worker_id += 1
+        worker_id = self._worker_id
+        put = self._worker_queue.put
+
+        def run():
+            try:
+                put((label, worker_id, "done", work(lambda fraction: put((label, worker_id, "progress", fraction)))))
+            except Exception as e:
+                put((label, worker_id, "error", e))
+
+        self._workers[label] = (worker_id, on_done)
+        self.tk_vars["tkv_STATUS"].set(label + "...")
+        threading.Thread(target = run, daemon = True).start()
+        if not self._polling:
+            self._polling = True
+            self.after(self.POLL_INTERVAL, self.poll_worker)
+
+    def poll_worker(self):
+        """Applies messages from the background workers; reschedules until all are done"""
+        try:
+            while True:
+                try:
+                    label, worker_id, kind, value = self._worker_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if label not in self._workers or self._workers[label][0] != worker_id:
+                    continue
+                if kind == "progress":
+                    self.tk_vars["tkv_STATUS"].set("{} {:.0%}".format(label, value))
+                    continue
+                on_done = self._workers.pop(label)[1]
+                if kind == "error":
+                    self.tk_vars["tkv_STATUS"].set("Failed: {}".format(value))
+                    continue
+                self.tk_vars["tkv_STATUS"].set(" ".join(running + "..." for running in self._workers))
+                on_done(value)
+        finally:
+            # Also keeps polling jobs started by on_done, or left running if it fails
+            if self._workers:
+                self.after(self.POLL_INTERVAL, self.poll_worker)
+            else:
+                self._polling = False
+
+    def find_nearest(self, v):
+        return self.x_lookup.nearest(v)[0]
+
+    def find_surrounding(self, v):
+        lo, hi = self.x_lookup.surrounding(v)
+        return self.x_lookup.keys[lo], self.x_lookup.keys[hi]
+
+    def schedule_idle(self, key, callback):
+        """Runs callback once Tk is idle, however often it is requested before then"""
+        if key not in self._idle_jobs:
+            def run():
+                del self._idle_jobs[key]
+                callback()
+            self._idle_jobs[key] = self.after_idle(run)
 
     def motion(self, event):
-        self.canvas_PLOT.coords(self.canvasline_VTCROSSHAIR, event.x, 1, event.x, 601)
-        self.canvas_PLOT.coords(self.canvasline_HZCROSSHAIR, 1, event.y, 1000, event.y)
+        self._pointer = (event.x, event.y)
+        self.schedule_idle("crosshair", self.draw_crosshair)
+
+    def draw_crosshair(self):
+        x, y = self._pointer
+        self.canvas_PLOT.coords(self.canvasline_VTCROSSHAIR, x, 1, x, 601)
+        self.canvas_PLOT.coords(self.canvasline_HZCROSSHAIR, 1, y, 1000, y)
     
     def interpolate_y(self, x):
-        x1, x2 = self.find_surrounding(x, list(self.x_array))
-        y1 = list(self.y_array)[list(self.x_array).index(x1)]
-        y2 = list(self.y_array)[list(self.x_array).index(x2)]
-        slope = (y2 - y1) / (x2 - x1)
-        intercept = y1 - slope * x1
-        return slope * x + intercept
+        return self.x_lookup.interpolate(x)
     
     def interpolate_x(self, y):
-        y1, y2 = self.find_surrounding(y, list(self.y_array))
-        x1 = self.x_array[list(self.y_array).index(y1)]
-        x2 = self.x_array[list(self.y_array).index(y2)]
-        slope = (x2 - x1) / (y2 - y1)
-        intercept = x1 - slope * y1
-        return slope * y + intercept
+        return self.y_lookup.interpolate(y)
         
     def click(self, event):
         map_x, map_y = event.x+1, event.y+1
         data_x, data_y = self.transform_map_to_data(event.x, event.y)
         print(data_x, data_y)
         if self.tk_vars["tkv_SNAP"].get():
-            data_x = self.find_nearest(data_x, list(self.x_array))
+            data_x, bank_y = self.x_lookup.nearest(data_x)
             map_x = self.transform_data_to_map(data_x, data_y)[0]
+        else:
+            bank_y = self.interpolate_y(data_x)
 
-        if self.tk_vars['tkv_SELECTEDBANK'].get() == 0:
-            self.canvas_PLOT.coords(self.canvasline_LHB, map_x, 1, map_x, 601)
-            self.canvas_PLOT.coords(self.canvaslabel_LHB, map_x, 1)
-            self.tk_vars["tkv_LHB_x"].set(data_x)
-            if self.tk_vars["tkv_SNAP"].get():
-                self.tk_vars["tkv_LHB_y"].set(list(self.y_array)[list(self.x_array).index(data_x)])
-            else:
-                self.tk_vars["tkv_LHB_y"].set(self.interpolate_y(data_x))
-            
-        if self.tk_vars['tkv_SELECTEDBANK'].get() == 1:
-            self.canvas_PLOT.coords(self.canvasline_RHB, map_x, 1, map_x, 601)
-            self.canvas_PLOT.coords(self.canvaslabel_RHB, map_x, 1)
-            self.tk_vars["tkv_RHB_x"].set(data_x)
-            if self.tk_vars["tkv_SNAP"].get():
-                self.tk_vars["tkv_RHB_y"].set(list(self.y_array)[list(self.x_array).index(data_x)])
-            else:
-                self.tk_vars["tkv_RHB_y"].set(self.interpolate_y(data_x))
-            
-        self.tk_vars["tkv_CHANNELWIDTH"].set(round(self.tk_vars["tkv_RHB_x"].get() - self.tk_vars["tkv_LHB_x"].get(), 4))
-        self.tk_vars["tkv_CHANNELDEPTH"].set(round(min(self.tk_vars["tkv_LHB_y"].get(), self.tk_vars["tkv_RHB_y"].get()) - self.y_array.min(), 4)) # THIS NEEDS TO BE FIXED TO ONLY INCLUDE POINTS BETWEEN A CERTAIN RANGE
-        self.tk_vars["tkv_CHANNELWDRATIO"].set(round(self.tk_vars["tkv_CHANNELWIDTH"].get()/self.tk_vars["tkv_CHANNELDEPTH"].get(), 4))
+        self.place_bank(self.tk_vars['tkv_SELECTEDBANK'].get(), map_x, data_x, bank_y)
         self.get_channel_coordinates()
-    
+
+    def place_bank(self, bank, map_x, data_x, bank_y):
+        """Moves the left (bank 0) or right (bank 1) bank line and its coordinates"""
+        line, label, name = ((self.canvasline_LHB, self.canvaslabel_LHB, "LHB") if bank == 0 
+                             else (self.canvasline_RHB, self.canvaslabel_RHB, "RHB"))
+        self.canvas_PLOT.coords(line, map_x, 1, map_x, 601)
+        self.canvas_PLOT.coords(label, map_x, 1)
+        self.tk_vars["tkv_{}_x".format(name)].set(data_x)
+        self.tk_vars["tkv_{}_y".format(name)].set(bank_y)
+        if self.session is not None:
+            self.session.set_bank(self.station_index, bank, data_x, bank_y)
+
+    def detect_banks(self):
+        """Places both banks with the automatic rule chosen under Auto banks.
+
+        Detection runs on a worker thread, as long profiles take a while.
+        """
+        rule = self.tk_vars["tkv_AUTOBANKS"].get()
+        if rule not in BANK_RULES or self.channel_geometry is None:
+            return
+        geometry = self.channel_geometry
+        self.run_in_background(lambda progress: BANK_RULES[rule](geometry),
+                               lambda banks: self.place_detected_banks(geometry, *banks), "Detecting banks")
+
+    def place_detected_banks(self, geometry, lhb, rhb):
+        if geometry is not self.channel_geometry:
+            return
+        for bank, data_x in ((0, lhb), (1, rhb)):
+            self.place_bank(bank, self.transform_data_to_map(data_x, 0)[0], data_x, geometry.bed(data_x))
+        self.get_channel_coordinates()
+
     def PolyArea(self, x,y):
-        return 0.5*np.abs(np.dot(x,np.roll(y,1))-np.dot(y,np.roll(x,1)))
+        return poly_area(x, y)
 
     def get_channel_coordinates(self):
-        self.df_plot = pd.DataFrame({"x_vals": self.x_array, 
-                                     "y_vals": self.y_array})
-        self.df_plot = self.df_plot[(self.df_plot['x_vals'] > self.tk_vars["tkv_LHB_x"].get()) & (self.df_plot['x_vals'] < self.tk_vars["tkv_RHB_x"].get())]
-        self.df_plot.loc[-1] = [self.tk_vars["tkv_LHB_x"].get(), self.tk_vars["tkv_LHB_y"].get()]
-        self.df_plot.index = self.df_plot.index + 1
-        self.df_plot = self.df_plot.sort_index() 
-        self.df_plot = self.df_plot.append({'x_vals': self.tk_vars["tkv_RHB_x"].get(),
-                                            'y_vals': self.tk_vars["tkv_RHB_y"].get()}, ignore_index=True)
-        
-
-        self.tk_vars["tkv_CHANNELAREA"].set(round(self.PolyArea(self.df_plot['x_vals'], 
-                                                          self.df_plot['y_vals']), 4))
-        self.ca_x_map, self.ca_y_map = self.transform_data_to_map(self.df_plot["x_vals"].to_numpy(), self.df_plot["y_vals"].to_numpy())
-        self.all_map_ca_vals = []
-        for count, val in enumerate(list(self.ca_x_map)):
-            self.all_map_ca_vals.append(val)
-            self.all_map_ca_vals.append(self.ca_y_map[count])
-        self.canvas_PLOT.coords(self.canvaspolygon_CHANNEL, *self.all_map_ca_vals)
+        """Updates the channel metrics and polygon for the current bank pair"""
+        bank_xy = (self.tk_vars["tkv_LHB_x"].get(), self.tk_vars["tkv_LHB_y"].get(),
+                   self.tk_vars["tkv_RHB_x"].get(), self.tk_vars["tkv_RHB_y"].get())
+        metrics = self.channel_geometry.bank_metrics(*bank_xy)
+        self.tk_vars["tkv_CHANNELWIDTH"].set(round(metrics["width"], 4))
+        self.tk_vars["tkv_CHANNELDEPTH"].set(round(metrics["depth"], 4))
+        self.tk_vars["tkv_CHANNELWDRATIO"].set(round(metrics["wd_ratio"], 4))
+        self.tk_vars["tkv_CHANNELAREA"].set(round(metrics["area"], 4))
+        self.ca_x_map, self.ca_y_map = self.transform_data_to_map(*self.channel_geometry.polygon(*bank_xy))
+        self.canvas_PLOT.coords(self.canvaspolygon_CHANNEL, *np.column_stack([self.ca_x_map, self.ca_y_map]).ravel())
 
 
     def plot(self):
-        """Draws the points on a tk Canvas object"""
+        """Draws the points on a tk Canvas object.
+
+        The selected columns of a CSV file are first read on a worker thread
+        (see read_columns), and the profile is drawn once they are loaded.
+        In a job session the current station is redrawn.
+        """
+        if self.session is not None:
+            self.show_station(self.station_index, redraw = True)
+            return
+        columns = list(dict.fromkeys([self.tk_vars["tkv_XVALSVARNAME"].get(), 
+                                      self.tk_vars["tkv_YVALSVARNAME"].get()]))
+        if self.df is None or not all(c in self.df.columns for c in columns):
+            if self.fpath is None or self.fpath.endswith(".npz"):
+                return
+            fpath = self.fpath
+            self.run_in_background(lambda progress: read_columns(fpath, columns, progress = progress),
+                                   self.plot_loaded, "Loading")
+            return
+        # Drop incomplete rows from both columns together so x and y stay paired
+        df_xy = self.df[[self.tk_vars["tkv_XVALSVARNAME"].get(), 
+                         self.tk_vars["tkv_YVALSVARNAME"].get()]].dropna()
+        self.load_data(df_xy.iloc[:, 0].to_numpy(), df_xy.iloc[:, 1].to_numpy())
+        self.draw(self.x_array_map, self.y_array_flipped_map)
+        self.detect_banks()
+
+    def draw(self, x_map, y_map):
+        """Draws a profile from its canvas coordinates on the current canvas"""
         self.canvas_PLOT.delete("all")
         self.canvaspolygon_CHANNEL = self.canvas_PLOT.create_polygon(1, 1, 1, 1, 1, 1, fill="blue")  
         self.canvasline_VTCROSSHAIR = self.canvas_PLOT.create_line(500, 0, 500, 600, fill = 'gray')
@@ -378,15 +859,22 @@ class App(tk.Tk):
         self.canvasline_RHB = self.canvas_PLOT.create_line(1100, 0, 1100, 600, fill = 'yellow', dash=(10, 10))
         self.canvaslabel_LHB = self.canvas_PLOT.create_text(0, 2000, text = "LHB", anchor=tk.NW, fill='yellow')
         self.canvaslabel_RHB = self.canvas_PLOT.create_text(0, 2000, text = "RHB", anchor=tk.NW, fill='yellow')
-        self.load_data(self.df[self.tk_vars["tkv_XVALSVARNAME"].get()].dropna(),
-                       self.df[self.tk_vars["tkv_YVALSVARNAME"].get()].dropna())
-        line_points = []
-        for count, coordinate in enumerate(self.x_array_map):
-            y = self.y_array_flipped_map[count]
-            line_points.append(coordinate)
-            line_points.append(y)
-            self.canvas_PLOT.create_rectangle(coordinate-2, y-2, coordinate+2, y+2, fill = 'white')
-        self.canvasline_PLOT = self.canvas_PLOT.create_line(*line_points, fill='white')
+        x_map = np.asarray(x_map, dtype = float)
+        y_map = np.asarray(y_map, dtype = float)
+        # The number of canvas items is bounded by the canvas width, not the
+        # number of survey points
+        keep = decimate_minmax(x_map, y_map)
+        line_points = np.column_stack([x_map[keep], y_map[keep]]).ravel().tolist()
+        if len(x_map) * self.MARKER_SPACING <= int(self.canvas_PLOT["width"]):
+            for x, y in zip(x_map.tolist(), y_map.tolist()):
+                self.canvas_PLOT.create_rectangle(x-2, y-2, x+2, y+2, fill = 'white')
+        if len(line_points) >= 4:
+            self.canvasline_PLOT = self.canvas_PLOT.create_line(*line_points, fill='white')
+
+    def plot_loaded(self, df):
+        """Keeps the columns read for plotting and draws them"""
+        self.df = df
+        self.plot()
     
     
         
@@ -398,6 +886,4 @@ class App(tk.Tk):
 
 if __name__ == "__main__": 
     app = App()
-    app.canvas_PLOT.bind('<Motion>', app.motion)
-    app.canvas_PLOT.bind('<Button-1>', app.click)
     app.mainloop()